@@ -1,107 +1,622 @@
+import json
+import os
 import random
-
-piece_score = {
-    "K":0, "Q":9, "R":5, "B":3, "N":3, "p":1
-}
-
-knight_scores = [[1, 1, 1, 1, 1, 1, 1, 1],
-                 [1, 2, 2, 2, 2, 2, 2, 1],
-                 [1, 2, 3, 3, 3, 3, 2, 1],
-                 [1, 2, 3, 4, 4, 3, 2, 1],
-                 [1, 2, 3, 4, 4, 3, 2, 1],
-                 [1, 2, 3, 3, 3, 3, 2, 1],
-                 [1, 2, 2, 2, 2, 2, 2, 1],
-                 [1, 1, 1, 1, 1, 1, 1, 1]]
-
-bishop_scores = [[4, 3, 2, 1, 1, 2, 3, 4],
-                 [3, 4, 3, 2, 2, 3, 4, 3],
-                 [2, 3, 4, 3, 3, 4, 3, 2],
-                 [1, 2, 3, 4, 4, 3, 2, 1],
-                 [1, 2, 3, 4, 4, 3, 2, 1],
-                 [2, 3, 4, 3, 3, 4, 3, 2],
-                 [3, 4, 3, 2, 2, 3, 4, 3],
-                 [4, 3, 2, 1, 1, 2, 3, 4]]
-
-queen_scores = [[1, 1, 1, 3, 1, 1, 1, 1],
-                 [1, 2, 3, 3, 3, 1, 1, 1],
-                 [1, 4, 3, 3, 3, 4, 2, 1],
-                 [1, 2, 3, 3, 3, 2, 2, 1],
-                 [1, 2, 3, 3, 3, 2, 2, 1],
-                 [1, 4, 3, 3, 3, 4, 2, 1],
-                 [1, 1, 2, 3, 3, 1, 1, 1],
-                 [1, 1, 1, 3, 1, 1, 1, 1]]
-
-rook_scores = [[4, 3, 4, 4, 4, 4, 3, 4],
-                 [4, 4, 4, 4, 4, 4, 4, 4],
-                 [1, 1, 2, 3, 3, 2, 1, 1],
-                 [1, 2, 3, 4, 4, 3, 2, 1],
-                 [1, 2, 3, 4, 4, 3, 2, 1],
-                 [1, 1, 2, 2, 2, 2, 1, 1],
-                 [4, 4, 4, 4, 4, 4, 4, 4],
-                 [4, 3, 4, 4, 4, 4, 3, 4]]
-
-white_pawn_scores = [[8, 8, 8, 8, 8, 8, 8, 8],
-                 [8, 8, 8, 8, 8, 8, 8, 8],
-                 [5, 6, 6, 7, 7, 6, 6, 5],
-                 [2, 3, 3, 5, 5, 3, 3, 2],
-                 [1, 2, 3, 4, 4, 3, 2, 1],
-                 [1, 1, 2, 3, 3, 2, 1, 1],
-                 [1, 1, 1, 0, 0, 1, 1, 1],
-                 [0, 0, 0, 0, 0, 0, 0, 0]]
-
-black_pawn_scores = [[0, 0, 0, 0, 0, 0, 0, 0],
-                 [1, 1, 1, 0, 0, 1, 1, 1],
-                 [1, 1, 2, 3, 3, 2, 1, 1],
-                 [1, 2, 3, 4, 4, 3, 2, 1],
-                 [2, 3, 3, 5, 5, 3, 3, 2],
-                 [5, 6, 6, 7, 7, 6, 6, 5],
-                 [8, 8, 8, 8, 8, 8, 8, 8],
-                 [8, 8, 8, 8, 8, 8, 8, 8]]
-
-
-piece_position_scores = {"N": knight_scores, "Q": queen_scores, "B": bishop_scores, "R": rook_scores, "bp": black_pawn_scores,
-                "wp": white_pawn_scores}
+import time
+from multiprocessing import Event, Pool, Value
+from ChessScores import *
+import ChessBook
+import ChessBitbase
 
 CHECKMATE = 1000
 STALEMATE = 0
-DEPTH = 3
+# iterative deepening stops at whichever comes first
+TIME_LIMIT = 2.0  # seconds per AI move
+MAX_DEPTH = 64
+# processes used to search one move, root moves are split between them when more than 1
+WORKERS = 1
+# Polyglot opening book, moves come from it while the position is in the book
+USE_BOOK = True
+BOOK_PATH = "assets/books/book.bin"
+# exact results for king + queen, rook or pawn against a lone king, from ChessBitbase tables
+USE_BITBASES = True
+BITBASE_WIN = 500  # below CHECKMATE, so a mate the search can see is still preferred
+# optional function polled every INTERRUPT_INTERVAL nodes, the search stops as soon as it returns True
+interrupt_check = None
+INTERRUPT_INTERVAL = 256
+# called with (depth, score for the side to move, nodes, best move) after every completed iteration
+iteration_callback = None
+# cross-check the incremental board score against a full scan at every leaf
+DEBUG_EVAL = False
+# collect node, cutoff and timing statistics of every search in search_stats, timing slows the search down
+COLLECT_STATS = False
+# when set, the statistics of every search are appended to this file as one JSON line
+STATS_PATH = None
+
+# transposition table settings, bound types describe how a stored score relates to the real one
+TT_SIZE_MB = 32
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+class TranspositionTable():
+
+    # rough size of one stored entry: the entry tuple, its ints and the list slot pointing to it
+    ENTRY_BYTES = 160
+
+    def __init__(self, size_mb=TT_SIZE_MB):
+        entries = max(2, size_mb * 1024 * 1024 // self.ENTRY_BYTES)
+        # power of two number of buckets so a key can be masked into an index
+        self.buckets = 1 << ((entries // 2).bit_length() - 1)
+        self.mask = self.buckets - 1
+        # every bucket has 2 slots: [depth preferred, always replace]
+        self.entries = [None] * (self.buckets * 2)
+        self.generation = 0
+
+    def clear(self):
+        self.entries = [None] * (self.buckets * 2)
+        self.generation = 0
+
+    # called once per search so entries left from older searches get replaced first
+    def newSearch(self):
+        self.generation += 1
+
+    # returns (key, depth, score, bound, move_ID, generation) or None
+    def probe(self, key):
+        index = (key & self.mask) * 2
+        entry = self.entries[index]
+        if entry is not None and entry[0] == key:
+            return entry
+        entry = self.entries[index + 1]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, score, bound, move_ID):
+        index = (key & self.mask) * 2
+        entry = (key, depth, score, bound, move_ID, self.generation)
+        old = self.entries[index]
+        # the first slot keeps the deepest result, old searches and the same position are always overwritten
+        if old is None or old[0] == key or old[5] != self.generation or depth >= old[1]:
+            self.entries[index] = entry
+        else:
+            self.entries[index + 1] = entry
+
+transposition_table = TranspositionTable()
+
+# attacker values for ordering captures, the king is the least welcome attacker to lose
+attacker_score = {"p": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 10}
+
+# move ordering bonuses, captures and killers are always tried before the other quiet moves
+TT_MOVE_BONUS = 1000000
+CAPTURE_BONUS = 100000
+KILLER_BONUS = 90000
+
+# two quiet moves per ply that recently caused a beta cutoff, stored as move IDs
+killer_moves = [[None, None] for ply in range(MAX_DEPTH + 1)]
+# how often a quiet move of a piece to a square caused a cutoff, weighted by depth
+history_scores = {piece: [0] * 64 for piece in ("wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK")}
+
+# Sort the moves so the ones most likely to cause a cutoff are searched first
+def orderMoves(valid_moves, tt_move_ID, ply):
+    killers = killer_moves[ply]
+
+    def moveOrderScore(move):
+        if move.move_ID == tt_move_ID:
+            return TT_MOVE_BONUS
+        if move.is_capture:
+            return CAPTURE_BONUS + captureOrderScore(move)
+        if move.move_ID == killers[0]:
+            return KILLER_BONUS + 1
+        if move.move_ID == killers[1]:
+            return KILLER_BONUS
+        return historyOrderScore(move)
+
+    return sorted(valid_moves, key=moveOrderScore, reverse=True)
+
+# Quiet moves by how often the same piece to the same square caused a cutoff
+def historyOrderScore(move):
+    return history_scores[move.piece_moved][move.end_row * 8 + move.end_col]
+
+# Most valuable victim, least valuable attacker
+def captureOrderScore(move):
+    return piece_score[move.piece_captured[1]] * 10 - attacker_score[move.piece_moved[1]]
+
+# Remember a quiet move that caused a beta cutoff so it is tried early in sibling positions
+def storeCutoffMove(move, depth, ply):
+    killers = killer_moves[ply]
+    if killers[0] != move.move_ID:
+        killers[1] = killers[0]
+        killers[0] = move.move_ID
+    history_scores[move.piece_moved][move.end_row * 8 + move.end_col] += depth * depth
+
+# Forget the killers of the last search and age the history so new cutoffs count more
+def resetMoveOrdering():
+    for killers in killer_moves:
+        killers[0] = killers[1] = None
+    for scores in history_scores.values():
+        for i in range(64):
+            scores[i] //= 2
 
 def fineRandomMove(valid_moves):
     return valid_moves[random.randint(0, len(valid_moves) -1 )]
 
-# Helper method to make first recursive call
-def findBestMove(gs, valid_moves, return_queue):
-    global next_move
+opening_book = None
+
+# A weighted random book move, or None when there is no book or the position isn't in it
+def getBookMove(gs, valid_moves):
+    global opening_book
+    if not USE_BOOK:
+        return None
+    if opening_book is None:
+        if not os.path.exists(BOOK_PATH):
+            return None
+        opening_book = ChessBook.PolyglotBook(BOOK_PATH)
+    return opening_book.chooseMove(gs, valid_moves)
+
+# Raised inside the search when the time budget runs out
+class SearchTimeout(Exception):
+    pass
+
+# Search statistics, only gathered when COLLECT_STATS is set.
+# search_stats holds the last search's totals and a list of its completed iterations, each with per ply counts.
+search_stats = None
+ply_nodes = [0] * (MAX_DEPTH + 1)
+ply_cutoffs = [0] * (MAX_DEPTH + 1)
+ply_first_move_cutoffs = [0] * (MAX_DEPTH + 1)  # cutoffs on the first move searched, a measure of move ordering
+stat_times = {}
+# the functions timed, GameState methods are wrapped on the searched instance for the length of the search
+TIMED_METHODS = {
+    "getValidMoves": ("getValidMoves", "getValidCaptures", "startMoveStages", "getStageMoves",
+                      "findStageMove", "getStagePieceMoves"),
+    "makeMove": ("makeMove",),
+    "undoMoves": ("undoMoves",),
+}
+timers_running = set()
+
+# Adds the time spent in function to stat_times[name], calls nested inside another of the same name aren't counted twice
+def timedFunction(function, name):
+    def timed(*args, **kwargs):
+        if name in timers_running:
+            return function(*args, **kwargs)
+        timers_running.add(name)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stat_times[name] += time.perf_counter() - start
+            timers_running.discard(name)
+    return timed
+
+def startStatsTimers(gs):
+    global scoreBoard
+    for name, methods in TIMED_METHODS.items():
+        for method in methods:
+            setattr(gs, method, timedFunction(getattr(gs, method), name))
+    scoreBoard = timedFunction(untimedScoreBoard, "scoreBoard")
+
+def stopStatsTimers(gs):
+    global scoreBoard
+    for methods in TIMED_METHODS.values():
+        for method in methods:
+            if method in gs.__dict__:
+                del gs.__dict__[method]
+    scoreBoard = untimedScoreBoard
+    timers_running.clear()
+
+def resetIterationStats():
+    for ply in range(MAX_DEPTH + 1):
+        ply_nodes[ply] = ply_cutoffs[ply] = ply_first_move_cutoffs[ply] = 0
+    for name in list(TIMED_METHODS) + ["scoreBoard"]:
+        stat_times[name] = 0
+
+def cutoffRate(first_move_cutoffs, cutoffs):
+    return first_move_cutoffs / cutoffs if cutoffs else None
+
+# The statistics of one completed iteration, nodes and seconds are its own, not the running totals
+def iterationStats(depth, score, nodes, seconds, previous_nodes):
+    cutoffs = sum(ply_cutoffs)
+    first_move_cutoffs = sum(ply_first_move_cutoffs)
+    return {
+        "depth": depth,
+        "score": score,
+        "nodes": nodes,
+        "seconds": seconds,
+        "nps": nodes / seconds if seconds > 0 else None,
+        # how many times more nodes this iteration needed than the last one
+        "branching_factor": nodes / previous_nodes if previous_nodes else None,
+        "cutoffs": cutoffs,
+        "first_move_cutoffs": first_move_cutoffs,
+        "first_move_cutoff_rate": cutoffRate(first_move_cutoffs, cutoffs),
+        "times": dict(stat_times),
+        # quiescence nodes are counted in nodes but not by ply
+        "plies": [{"ply": ply, "nodes": ply_nodes[ply], "cutoffs": ply_cutoffs[ply],
+                   "first_move_cutoff_rate": cutoffRate(ply_first_move_cutoffs[ply], ply_cutoffs[ply])}
+                  for ply in range(depth)],
+    }
+
+# Totals over the completed iterations of a search
+def searchStats(move, iterations, seconds):
+    nodes = sum(iteration["nodes"] for iteration in iterations)
+    cutoffs = sum(iteration["cutoffs"] for iteration in iterations)
+    first_move_cutoffs = sum(iteration["first_move_cutoffs"] for iteration in iterations)
+    return {
+        "move": move.getChessNotation() if move is not None else None,
+        "depth": iterations[-1]["depth"] if iterations else 0,
+        "nodes": nodes,
+        "seconds": seconds,
+        "nps": nodes / seconds if seconds > 0 else None,
+        "cutoffs": cutoffs,
+        "first_move_cutoff_rate": cutoffRate(first_move_cutoffs, cutoffs),
+        "times": {name: sum(iteration["times"][name] for iteration in iterations) for name in stat_times},
+        "iterations": iterations,
+    }
+
+# Append one search's statistics to a JSON lines file
+def writeStats(stats, path):
+    with open(path, "a") as f:
+        f.write(json.dumps(stats) + "\n")
+
+# Search with statistics collected, returns (best move, statistics), the statistics are None for a book move
+def searchWithStats(gs, valid_moves, time_limit=TIME_LIMIT, max_depth=MAX_DEPTH, workers=WORKERS):
+    global COLLECT_STATS
+    collecting = COLLECT_STATS
+    COLLECT_STATS = True
+    try:
+        move = searchBestMove(gs, valid_moves, time_limit, max_depth, workers)
+    finally:
+        COLLECT_STATS = collecting
+    return move, search_stats
+
+# Process target: search and hand the best move back through the queue
+def findBestMove(gs, valid_moves, return_queue, time_limit=TIME_LIMIT, max_depth=MAX_DEPTH, workers=WORKERS):
+    return_queue.put(searchBestMove(gs, valid_moves, time_limit, max_depth, workers))
+
+# Helper method to make first recursive call, deepens one ply at a time until the time is up
+def searchBestMove(gs, valid_moves, time_limit=TIME_LIMIT, max_depth=MAX_DEPTH, workers=WORKERS):
+    global next_move, search_depth, deadline, root_move, nodes_searched, root_piece_count, search_stats
+    # killer_moves and the per ply stats are sized when the module is imported, a deeper search would run off them
+    max_depth = min(max_depth, len(killer_moves) - 1)
+    root_piece_count = gs.piece_count
+    search_stats = None
+    book_move = getBookMove(gs, valid_moves)
+    if book_move is not None:
+        return book_move
+    if workers > 1:
+        # the workers' counters stay in their processes, only the parallel search's own figures are kept
+        move = findBestMoveParallel(gs, valid_moves, time_limit, max_depth, workers)
+        if COLLECT_STATS:
+            search_stats = dict(parallel_stats, move=move.getChessNotation() if move is not None else None)
+        return move
+
     next_move = None
+    nodes_searched = 0
     random.shuffle(valid_moves)
+    transposition_table.newSearch()
+    resetMoveOrdering()
+    start = time.perf_counter()
+    deadline = start + time_limit
+    log_length = len(gs.moveLog)
+    collecting = COLLECT_STATS
+    iterations = []
+    if collecting:
+        startStatsTimers(gs)
+
+    try:
+        for depth in range(1, max_depth + 1):
+            search_depth = depth
+            root_move = None
+            iteration_start = time.perf_counter()
+            iteration_start_nodes = nodes_searched
+            if collecting:
+                resetIterationStats()
+            try:
+                score = findMoveNegaMaxAlphaBeta(gs, valid_moves, depth, -CHECKMATE, CHECKMATE, 1 if gs.white_to_move else -1)
+            except SearchTimeout:
+                # drop the unfinished iteration and take back the moves it left on the board
+                while len(gs.moveLog) > log_length:
+                    gs.undoMoves()
+                break
+            # publish the best move of every completed iteration
+            if root_move is not None:
+                next_move = root_move
+            if collecting:
+                iterations.append(iterationStats(depth, score, nodes_searched - iteration_start_nodes,
+                                                 time.perf_counter() - iteration_start,
+                                                 iterations[-1]["nodes"] if iterations else None))
+            if iteration_callback is not None:
+                iteration_callback(depth, score, nodes_searched, next_move)
+            if abs(score) >= CHECKMATE or len(valid_moves) <= 1:
+                break
+    finally:
+        if collecting:
+            stopStatsTimers(gs)
 
-    findMoveNegaMaxAlphaBeta(gs, valid_moves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.white_to_move else -1)
+    if collecting:
+        search_stats = searchStats(next_move, iterations, time.perf_counter() - start)
+        if STATS_PATH is not None:
+            writeStats(search_stats, STATS_PATH)
+    return next_move
 
-    return_queue.put(next_move)
+# Called at every node, stops the search when the time is up or the caller interrupts it
+def checkSearchLimits():
+    global nodes_searched
+    nodes_searched += 1
+    # the first iteration always finishes so there is a move to play
+    if search_depth > 1 and time.perf_counter() > deadline:
+        raise SearchTimeout()
+    if nodes_searched % INTERRUPT_INTERVAL == 0:
+        if pool_stop is not None:
+            # in a pool worker: report the nodes to the parent and stop when it says so
+            with pool_nodes.get_lock():
+                pool_nodes.value += INTERRUPT_INTERVAL
+            if pool_stop.is_set():
+                raise SearchTimeout()
+        if interrupt_check is not None and interrupt_check():
+            raise SearchTimeout()
+
+worker_pool = None
+worker_pool_size = 0
+# shared with the pool's workers: set by the parent to stop their searches, and their node count so far
+pool_stop = None
+pool_nodes = None
+POOL_POLL_SECONDS = 0.01  # how often the parent checks interrupt_check while the workers search
+
+# Runs in every pool worker when it starts. The hooks of the parent process were copied into the worker,
+# but they belong to the parent, which polls them itself.
+def initPoolWorker(stop, nodes):
+    global pool_stop, pool_nodes, interrupt_check, iteration_callback
+    pool_stop = stop
+    pool_nodes = nodes
+    interrupt_check = None
+    iteration_callback = None
+
+# The pool is kept between searches so workers keep their transposition tables
+def getWorkerPool(workers):
+    global worker_pool, worker_pool_size, worker_pool_stop, worker_pool_nodes
+    if worker_pool is None or worker_pool_size != workers:
+        if worker_pool is not None:
+            worker_pool.terminate()
+        worker_pool_stop = Event()
+        worker_pool_nodes = Value("q", 0)
+        worker_pool = Pool(workers, initializer=initPoolWorker, initargs=(worker_pool_stop, worker_pool_nodes))
+        worker_pool_size = workers
+    return worker_pool
+
+# Wait for a task handed to the pool while polling interrupt_check, nodes_searched follows the workers' count.
+# Returns the task's result, or None when the search was interrupted.
+def waitForPool(async_result, nodes_before):
+    global nodes_searched
+    while not async_result.ready():
+        async_result.wait(POOL_POLL_SECONDS)
+        nodes_searched = nodes_before + worker_pool_nodes.value
+        if interrupt_check is not None and interrupt_check():
+            worker_pool_stop.set()
+            async_result.wait()
+            worker_pool_stop.clear()
+            return None
+    # the caller adds the exact counts the workers return
+    nodes_searched = nodes_before
+    return async_result.get()
+
+# Iterative deepening where every iteration splits the root moves between worker processes.
+# Equal scores are decided by root order rather than by which worker finishes first, but the root order starts
+# shuffled and every worker keeps its own tables between searches, so two searches of a position can still differ.
+def findBestMoveParallel(gs, valid_moves, time_limit, max_depth, workers):
+    global parallel_stats, nodes_searched
+    nodes_searched = 0
+    start = time.perf_counter()
+    deadline = start + time_limit
+    pool = getWorkerPool(workers)
+    random.shuffle(valid_moves)
+    moves_by_ID = {move.move_ID: move for move in valid_moves}
+    root_order = [move.move_ID for move in valid_moves]
+    best_move = None
+    busy_time = 0
+    completed_depth = 0
+
+    for depth in range(1, max_depth + 1):
+        time_left = deadline - time.perf_counter()
+        if depth > 1 and time_left <= 0:
+            break
+        if interrupt_check is not None and interrupt_check():
+            break
+        # search the expected best move first so the other moves can be searched with its score as alpha
+        worker_pool_nodes.value = 0
+        first_result = waitForPool(pool.apply_async(searchRootMoves, (gs, root_order[:1], depth, time_left, -CHECKMATE)),
+                                   nodes_searched)
+        if first_result is None:
+            break
+        nodes_searched += first_result[2]
+        alpha = first_result[0][0][1]
+        if interrupt_check is not None and interrupt_check():
+            break
+        # deal the other moves out round-robin so every worker gets some of the best moves from the last iteration
+        time_left = deadline - time.perf_counter()
+        tasks = [(gs, root_order[1 + i::workers], depth, time_left, alpha) for i in range(workers)]
+        worker_pool_nodes.value = 0
+        results = waitForPool(pool.starmap_async(searchRootMoves, tasks), nodes_searched)
+        if results is None or None in results:
+            break
+
+        scores = {}
+        for worker_scores, worker_time, worker_nodes in results:
+            nodes_searched += worker_nodes
+        for worker_scores, worker_time, worker_nodes in [first_result] + results:
+            scores.update(worker_scores)
+            busy_time += worker_time
+        root_order.sort(key=lambda move_ID: scores[move_ID], reverse=True)  # stable, so ties keep root order
+        best_move = moves_by_ID[root_order[0]]
+        completed_depth = depth
+        if iteration_callback is not None:
+            iteration_callback(depth, scores[root_order[0]], nodes_searched, best_move)
+        if abs(scores[root_order[0]]) >= CHECKMATE or len(root_order) <= 1:
+            break
+
+    wall_time = time.perf_counter() - start
+    parallel_stats = {
+        "workers": workers,
+        "depth": completed_depth,
+        "seconds": wall_time,
+        "busy_seconds": busy_time,
+        # share of the workers' time spent searching rather than waiting for the slowest worker
+        "efficiency": busy_time / (wall_time * workers) if wall_time > 0 else 0,
+    }
+    return best_move
+
+# Runs in a worker process: score some of the root moves at a fixed depth, scores at or below alpha are upper bounds.
+# Returns ([(move_ID, score)], seconds, nodes) or None if the time ran out first.
+def searchRootMoves(gs, move_IDs, depth, time_left, alpha):
+    global search_depth, deadline, nodes_searched, root_piece_count
+    root_piece_count = gs.piece_count
+    start = time.perf_counter()
+    nodes_searched = 0
+    deadline = start + time_left
+    search_depth = depth
+    if depth == 1:
+        transposition_table.newSearch()
+        resetMoveOrdering()
+
+    valid_moves = {move.move_ID: move for move in gs.getValidMoves()}
+    turn_multiplier = 1 if gs.white_to_move else -1
+    scores = []
+    try:
+        for move_ID in move_IDs:
+            move = valid_moves[move_ID]
+            gs.makeMove(move)
+            score = -findMoveNegaMaxAlphaBeta(gs, None, depth - 1, -CHECKMATE, -alpha, -turn_multiplier)
+            gs.undoMoves()
+            scores.append((move_ID, score))
+            if score > alpha:
+                alpha = score
+    except SearchTimeout:
+        return None
+    return scores, time.perf_counter() - start, nodes_searched
 
 def findMoveNegaMaxAlphaBeta(gs, valid_moves, depth, alpha, beta, turn_multiplier):
-    global next_move
+    global root_move
 
     if depth == 0:
-        return turn_multiplier * scoreBoard(gs)    
+        return quiescenceSearch(gs, alpha, beta, turn_multiplier)
+    checkSearchLimits()
+    if COLLECT_STATS:
+        ply_nodes[search_depth - depth] += 1
+
+    # a capture into a bitbase endgame ends the search with the exact result. Once the game itself is in one
+    # the search carries on, with the bitbase as its evaluation, so it can find how to make progress.
+    if USE_BITBASES and gs.piece_count <= 3 and root_piece_count > 3:
+        result = ChessBitbase.probeBitbase(gs)
+        if result is not None:
+            return turn_multiplier * scoreBitbaseResult(gs, result)
+
+    # use what an earlier search learned about this position, except at the root where a move is needed
+    alpha_original = alpha
+    entry = transposition_table.probe(gs.zobrist_key)
+    if entry is not None:
+        if entry[1] >= depth and depth != search_depth:
+            if entry[3] == EXACT:
+                return entry[2]
+            elif entry[3] == LOWER_BOUND:
+                alpha = max(alpha, entry[2])
+            else:
+                beta = min(beta, entry[2])
+            if alpha >= beta:
+                return entry[2]
+
+    # search the stored best move first, then captures, killers and quiet moves by history.
+    # Below the root the moves come in stages, so a cutoff on an early move never generates the rest.
+    ply = search_depth - depth
+    tt_move_ID = entry[4] if entry is not None else None
+    if valid_moves is not None:
+        moves = orderMoves(valid_moves, tt_move_ID, ply)
+    else:
+        moves = gs.generateStagedMoves(tt_move_ID, killer_moves[ply], captureOrderScore, historyOrderScore)
 
     max_score = -CHECKMATE
-    for move in valid_moves:
+    best_move_ID = None
+    move_count = 0
+    for move in moves:
+        move_count += 1
         gs.makeMove(move)
-        next_moves = gs.getValidMoves()
-        score = -findMoveNegaMaxAlphaBeta(gs, next_moves, depth-1, -beta, -alpha, -turn_multiplier)
+        score = -findMoveNegaMaxAlphaBeta(gs, None, depth-1, -beta, -alpha, -turn_multiplier)
         if score > max_score:
             max_score = score
-            if depth == DEPTH:
-                next_move = move
+            best_move_ID = move.move_ID
+            if depth == search_depth:
+                root_move = move
         gs.undoMoves()
         if max_score > alpha: 
             alpha = max_score
         if alpha >= beta:
+            if not move.is_capture:
+                storeCutoffMove(move, depth, ply)
+            if COLLECT_STATS:
+                ply_cutoffs[ply] += 1
+                if move_count == 1:
+                    ply_first_move_cutoffs[ply] += 1
             break
-    
+
+    # checkmate or stalemate
+    if move_count == 0:
+        return turn_multiplier * scoreBoard(gs)
+
+    if max_score <= alpha_original:
+        bound = UPPER_BOUND
+    elif max_score >= beta:
+        bound = LOWER_BOUND
+    else:
+        bound = EXACT
+    transposition_table.store(gs.zobrist_key, depth, max_score, bound, best_move_ID)
+
     return max_score
 
+# Search captures only until the position is quiet, so the horizon never falls in the middle of an exchange
+def quiescenceSearch(gs, alpha, beta, turn_multiplier):
+    checkSearchLimits()
+
+    # all evasions when in check, otherwise captures only
+    moves = gs.getValidCaptures()
+    stand_pat = turn_multiplier * scoreBoard(gs)
+    if gs.in_check:
+        if gs.check_mate:
+            return stand_pat
+        max_score = -CHECKMATE
+    else:
+        # the side to move can usually do at least as well as the static score by not capturing
+        if stand_pat >= beta:
+            return stand_pat
+        max_score = stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        moves.sort(key=captureOrderScore, reverse=True)
+
+    for move in moves:
+        gs.makeMove(move)
+        score = -quiescenceSearch(gs, -beta, -alpha, -turn_multiplier)
+        gs.undoMoves()
+        if score > max_score:
+            max_score = score
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+
+    return max_score
+
+# Score a known win so the search still makes progress: drive the losing king to the edge,
+# bring the winning king closer and push the pawn. A positive score is good for white.
+def scoreBitbaseResult(gs, result):
+    if result == 0:
+        return STALEMATE
+    if result > 0:
+        winning_king, losing_king = gs.white_king_location, gs.black_king_location
+    else:
+        winning_king, losing_king = gs.black_king_location, gs.white_king_location
+    center_distance = max(3 - losing_king[0], losing_king[0] - 4) + max(3 - losing_king[1], losing_king[1] - 4)
+    king_distance = abs(winning_king[0] - losing_king[0]) + abs(winning_king[1] - losing_king[1])
+    # material and piece squares already reward advancing and promoting the pawn
+    progress = abs(gs.board_score) / 10 + 4.7 * center_distance + 1.6 * (14 - king_distance)
+    return result * (BITBASE_WIN + progress)
+
 # A positive score is good for white, a negative score is good for black
 def scoreBoard(gs):
     if gs.check_mate:
@@ -112,6 +627,23 @@ def scoreBoard(gs):
     elif gs.stale_mate:
         return STALEMATE
 
+    if USE_BITBASES and gs.piece_count <= 3:
+        result = ChessBitbase.probeBitbase(gs)
+        if result is not None:
+            return scoreBitbaseResult(gs, result)
+
+    score = gs.board_score / 10
+    if DEBUG_EVAL:
+        full_score = scoreBoardFull(gs)
+        assert abs(score - full_score) < 1e-6, "incremental score %s != full scan %s" % (score, full_score)
+
+    return score
+
+# searches with statistics time scoreBoard by rebinding the name, this keeps the plain function
+untimedScoreBoard = scoreBoard
+
+# Scores every square of the board, only used to check the incremental score kept by GameState
+def scoreBoardFull(gs):
     score = 0
     for row in range(len(gs.board)):
         for col in range(len(gs.board[row])):
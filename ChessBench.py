@@ -0,0 +1,69 @@
+import argparse
+import json
+import time
+import ChessAI
+import ChessBitboard
+from ChessBitboard import newGameState
+from ChessPerft import PERFT_POSITIONS
+
+# Time a search to a fixed depth, so runs with different worker counts do the same work
+def timeSearch(fen, depth, workers):
+    gs = newGameState()
+    gs.loadFen(fen)
+    # a fresh table per run so earlier runs don't speed up later ones
+    ChessAI.transposition_table.clear()
+    start = time.perf_counter()
+    move = ChessAI.searchBestMove(gs, gs.getValidMoves(), time_limit=float("inf"), max_depth=depth, workers=workers)
+    return time.perf_counter() - start, move
+
+# Time-to-depth for every worker count, speedup and efficiency are relative to a single worker
+def runScaling(depth, worker_counts, fens):
+    results = []
+    for fen in fens:
+        baseline = None
+        for workers in worker_counts:
+            seconds, move = timeSearch(fen, depth, workers)
+            if workers == 1:
+                baseline = seconds
+            speedup = baseline / seconds if baseline else None
+            result = {
+                "fen": fen,
+                "depth": depth,
+                "workers": workers,
+                "seconds": round(seconds, 4),
+                "move": str(move),
+                "speedup": round(speedup, 3) if speedup else None,
+                "efficiency": round(speedup / workers, 3) if speedup else None,
+            }
+            if workers > 1:
+                result["worker_utilization"] = round(ChessAI.parallel_stats["efficiency"], 3)
+            results.append(result)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how the AI search scales with worker processes")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--fen", default=None, help="position to search, defaults to the perft positions")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--stats", default=None, help="append the statistics of every search to this JSON lines file")
+    parser.add_argument("--bitboards", action="store_true", help="search with the bitboard move generator")
+    args = parser.parse_args()
+    ChessBitboard.USE_BITBOARDS = args.bitboards
+
+    if args.stats is not None:
+        ChessAI.COLLECT_STATS = True
+        ChessAI.STATS_PATH = args.stats
+
+    fens = [args.fen] if args.fen is not None else [position["fen"] for position in PERFT_POSITIONS]
+    results = runScaling(args.depth, args.workers, fens)
+    for result in results:
+        print("%-70s workers %2d: %8.2fs speedup %s efficiency %s" % (
+            result["fen"], result["workers"], result["seconds"], result["speedup"], result["efficiency"]))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import argparse
+import mmap
+import os
+import time
+from array import array
+from collections import deque
+from ChessEngine import GameState
+
+'''
+Win/draw bitbases for king + one piece against a lone king (KQK, KRK and KPK), built by retrograde analysis
+with the move rules of ChessEngine.
+
+The side with the extra piece is always stored as white. A position is indexed by
+side to move << 18 | white king << 12 | black king << 6 | piece square, squares being row * 8 + col,
+and its bit is set when white wins with best play. White can never lose these endings, so with the side
+to move the bit gives the exact result: win or draw for white to move, loss or draw for black to move.
+'''
+
+BITBASE_DIR = "assets/bitbases"
+# tables that KPK promotes into have to be generated first
+MATERIALS = ("KQK", "KRK", "KPK")
+TABLE_SIZE = 2 << 18
+
+ILLEGAL = 255
+DRAW = 0
+WIN = 1
+
+def bitbasePath(material, directory=BITBASE_DIR):
+    return os.path.join(directory, material + ".bb")
+
+def positionIndex(white_to_move, white_king, black_king, piece_square):
+    return (0 if white_to_move else 1) << 18 | white_king << 12 | black_king << 6 | piece_square
+
+# Put the three pieces on an empty board, only the state move generation looks at is set up
+def setPosition(gs, piece, index):
+    gs.board = [["-"] * 8 for row in range(8)]
+    white_king = index >> 12 & 63
+    black_king = index >> 6 & 63
+    piece_square = index & 63
+    gs.board[white_king // 8][white_king % 8] = "wK"
+    gs.board[black_king // 8][black_king % 8] = "bK"
+    gs.board[piece_square // 8][piece_square % 8] = piece
+    gs.white_king_location = (white_king // 8, white_king % 8)
+    gs.black_king_location = (black_king // 8, black_king % 8)
+    gs.white_to_move = index >> 18 == 0
+
+def isLegalPosition(gs, piece, index):
+    white_king = index >> 12 & 63
+    black_king = index >> 6 & 63
+    piece_square = index & 63
+    if white_king == black_king or white_king == piece_square or black_king == piece_square:
+        return False
+    # pawns never stand on the first or last rank
+    if piece[1] == "p" and piece_square // 8 in (0, 7):
+        return False
+    # the side that just moved can't be in check
+    if gs.white_to_move:
+        return not gs.squareUnderAttack(black_king // 8, black_king % 8, "b")
+    return not gs.squareUnderAttack(white_king // 8, white_king % 8, "w")
+
+# Build the table for one material set, promotion_tables maps the promoted material ("KQK", "KRK") to its finished table
+def generateBitbase(material, promotion_tables=None):
+    piece = "w" + ("p" if material[1] == "P" else material[1])
+    promotion_tables = promotion_tables or {}
+    gs = GameState()
+    gs.current_castle_rights = 0
+    gs.enpassant_possible = ()
+
+    status = bytearray(TABLE_SIZE)
+    # for black to move, the number of replies that don't lose yet
+    remaining = array("i", [0]) * TABLE_SIZE
+    # (successor, position) pairs, turned into predecessor lists below
+    edge_to = array("i")
+    edge_from = array("i")
+    wins = deque()
+
+    for index in range(TABLE_SIZE):
+        setPosition(gs, piece, index)
+        if not isLegalPosition(gs, piece, index):
+            status[index] = ILLEGAL
+            continue
+
+        moves = gs.getValidMoves()
+        if len(moves) == 0:
+            if gs.in_check and not gs.white_to_move:
+                status[index] = WIN
+                wins.append(index)
+            continue
+
+        if not gs.white_to_move:
+            # capturing the piece draws, so such positions never run out of replies
+            remaining[index] = len(moves)
+
+        white_king = index >> 12 & 63
+        black_king = index >> 6 & 63
+        piece_square = index & 63
+        for move in moves:
+            end_square = move.end_row * 8 + move.end_col
+            if move.is_capture:
+                continue
+            if move.is_pawn_promotion:
+                table = promotion_tables.get("K" + move.promotion_piece + "K")
+                if table is not None and status[index] != WIN and table[positionIndex(False, white_king, black_king, end_square)] == WIN:
+                    status[index] = WIN
+                    wins.append(index)
+                continue
+            if move.piece_moved == "wK":
+                successor = positionIndex(False, end_square, black_king, piece_square)
+            elif move.piece_moved == "bK":
+                successor = positionIndex(True, white_king, end_square, piece_square)
+            else:
+                successor = positionIndex(False, white_king, black_king, end_square)
+            edge_to.append(successor)
+            edge_from.append(index)
+
+    # group the edges by successor so every position can find its predecessors
+    predecessor_start = array("i", [0]) * (TABLE_SIZE + 1)
+    for successor in edge_to:
+        predecessor_start[successor + 1] += 1
+    for index in range(TABLE_SIZE):
+        predecessor_start[index + 1] += predecessor_start[index]
+    predecessors = array("i", [0]) * len(edge_to)
+    fill = array("i", predecessor_start)
+    for i in range(len(edge_to)):
+        predecessors[fill[edge_to[i]]] = edge_from[i]
+        fill[edge_to[i]] += 1
+
+    # retrograde propagation: white wins if one move reaches a win, black loses if every reply reaches one
+    while wins:
+        index = wins.popleft()
+        for i in range(predecessor_start[index], predecessor_start[index + 1]):
+            predecessor = predecessors[i]
+            if status[predecessor] != DRAW:
+                continue
+            if predecessor >> 18 == 0:
+                status[predecessor] = WIN
+                wins.append(predecessor)
+            else:
+                remaining[predecessor] -= 1
+                if remaining[predecessor] == 0:
+                    status[predecessor] = WIN
+                    wins.append(predecessor)
+    return status
+
+# One bit per position, set for a white win
+def packBitbase(status):
+    bits = bytearray(TABLE_SIZE // 8)
+    for index in range(TABLE_SIZE):
+        if status[index] == WIN:
+            bits[index >> 3] |= 1 << (index & 7)
+    return bits
+
+class Bitbase():
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def isWin(self, index):
+        return self.data[index >> 3] >> (index & 7) & 1
+
+loaded_bitbases = None
+
+def loadBitbases(directory=BITBASE_DIR):
+    bitbases = {}
+    for material in MATERIALS:
+        path = bitbasePath(material, directory)
+        if os.path.exists(path):
+            bitbases[material] = Bitbase(path)
+    return bitbases
+
+# Exact result of a position with at most 3 pieces: 1 white wins, -1 black wins, 0 draw,
+# None when no table covers it
+def probeBitbase(gs):
+    global loaded_bitbases
+    if loaded_bitbases is None:
+        loaded_bitbases = loadBitbases()
+
+    pieces = []
+    for row in range(8):
+        for col in range(8):
+            if gs.board[row][col] != "-" and gs.board[row][col][1] != "K":
+                pieces.append((gs.board[row][col], row, col))
+    if len(pieces) == 0:
+        return 0
+    if len(pieces) > 1:
+        return None
+    piece, row, col = pieces[0]
+    if piece[1] in ("B", "N"):
+        return 0  # a lone minor piece can't mate
+    bitbase = loaded_bitbases.get("K" + piece[1].upper() + "K")
+    if bitbase is None:
+        return None
+
+    white_king = gs.white_king_location[0] * 8 + gs.white_king_location[1]
+    black_king = gs.black_king_location[0] * 8 + gs.black_king_location[1]
+    if piece[0] == "w":
+        index = positionIndex(gs.white_to_move, white_king, black_king, row * 8 + col)
+        return 1 if bitbase.isWin(index) else 0
+    # black has the piece: mirror the board so it becomes white's
+    index = positionIndex(not gs.white_to_move, 56 ^ black_king, 56 ^ white_king, 56 ^ (row * 8 + col))
+    return -1 if bitbase.isWin(index) else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the KQK, KRK and KPK endgame bitbases")
+    parser.add_argument("--output", default=BITBASE_DIR, help="directory to write the .bb files to")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    tables = {}
+    for material in MATERIALS:
+        start = time.perf_counter()
+        tables[material] = generateBitbase(material, tables)
+        with open(bitbasePath(material, args.output), "wb") as f:
+            f.write(packBitbase(tables[material]))
+        wins = tables[material].count(WIN)
+        legal = TABLE_SIZE - tables[material].count(ILLEGAL)
+        print("%s: %d of %d legal positions won for the stronger side (%.1fs)" % (
+            material, wins, legal, time.perf_counter() - start))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+from ChessEngine import GameState, Move, ray_squares, knight_squares, king_squares, \
+    WHITE_KING_SIDE, BLACK_KING_SIDE, WHITE_QUEEN_SIDE, BLACK_QUEEN_SIDE
+
+'''
+A bitboard version of GameState. Every piece has a 64-bit int with one bit per square it stands on,
+square = row * 8 + col like the move IDs, and legal moves come from shifts, masks and precomputed
+attack tables instead of walking the board.
+
+The list board is still kept up to date by the GameState methods, so the UI, Move, the position key and
+the score keep working unchanged; only move generation and attack tests are replaced.
+'''
+
+# make newGameState hand out BitboardGameState instead of GameState
+USE_BITBOARDS = False
+
+ALL_SQUARES = (1 << 64) - 1
+COL_0 = sum(1 << (row * 8) for row in range(8))
+COL_7 = COL_0 << 7
+ROW_2 = 0xFF << 16  # black pawns land here after one step from their start row
+ROW_5 = 0xFF << 40  # same for white pawns
+
+square_coords = [(sq // 8, sq % 8) for sq in range(64)]
+
+def squaresToMask(squares):
+    mask = 0
+    for row, col in squares:
+        mask |= 1 << (row * 8 + col)
+    return mask
+
+# ray_masks[j][sq] covers the squares from sq along directions[j] up to the edge, using the engine's tables
+ray_masks = [[squaresToMask(ray_squares[sq // 8][sq % 8][j]) for sq in range(64)] for j in range(8)]
+knight_attacks = [squaresToMask(knight_squares[sq // 8][sq % 8]) for sq in range(64)]
+king_attacks = [squaresToMask(king_squares[sq // 8][sq % 8]) for sq in range(64)]
+# squares attacked by a pawn of that color standing on sq
+pawn_attacks = {
+    "w": [squaresToMask((sq // 8 - 1, sq % 8 + dc) for dc in (-1, 1) if 0 <= sq % 8 + dc < 8 and sq >= 8) for sq in range(64)],
+    "b": [squaresToMask((sq // 8 + 1, sq % 8 + dc) for dc in (-1, 1) if 0 <= sq % 8 + dc < 8 and sq < 56) for sq in range(64)],
+}
+rook_masks = [ray_masks[0][sq] | ray_masks[1][sq] | ray_masks[2][sq] | ray_masks[3][sq] for sq in range(64)]
+bishop_masks = [ray_masks[4][sq] | ray_masks[5][sq] | ray_masks[6][sq] | ray_masks[7][sq] for sq in range(64)]
+
+# between_masks[a][b] holds the squares strictly between two squares on a common line,
+# line_masks[a][b] the whole line through both of them, edge to edge
+between_masks = [[0] * 64 for sq in range(64)]
+line_masks = [[0] * 64 for sq in range(64)]
+opposite_direction = (2, 3, 0, 1, 7, 6, 5, 4)
+for a in range(64):
+    for j in range(8):
+        line = ray_masks[j][a] | ray_masks[opposite_direction[j]][a] | 1 << a
+        between = 0
+        for row, col in ray_squares[a // 8][a % 8][j]:
+            b = row * 8 + col
+            between_masks[a][b] = between
+            line_masks[a][b] = line
+            between |= 1 << b
+
+# The first blocker on a ray is its lowest bit when the ray runs towards higher squares, its highest bit otherwise
+def rookAttacks(sq, occupied):
+    attacks = 0
+    for j in (2, 3):
+        ray = ray_masks[j][sq]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= ray_masks[j][(blockers & -blockers).bit_length() - 1]
+        attacks |= ray
+    for j in (0, 1):
+        ray = ray_masks[j][sq]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= ray_masks[j][blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+def bishopAttacks(sq, occupied):
+    attacks = 0
+    for j in (6, 7):
+        ray = ray_masks[j][sq]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= ray_masks[j][(blockers & -blockers).bit_length() - 1]
+        attacks |= ray
+    for j in (4, 5):
+        ray = ray_masks[j][sq]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= ray_masks[j][blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+def newGameState():
+    return BitboardGameState() if USE_BITBOARDS else GameState()
+
+
+class BitboardGameState(GameState):
+
+    def __init__(self):
+        super().__init__()
+        self.loadBitboards()
+
+    # Rebuild every piece bitboard from the list board
+    def loadBitboards(self):
+        self.bitboards = {piece: 0 for piece in ("wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK")}
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "-":
+                    self.bitboards[piece] |= 1 << (row * 8 + col)
+
+    def loadFen(self, fen):
+        super().loadFen(fen)
+        self.loadBitboards()
+
+    def makeMove(self, move):
+        super().makeMove(move)
+        self.updateBitboards(move)
+
+    def undoMoves(self):
+        if len(self.moveLog) != 0:
+            move = self.moveLog[-1]
+            super().undoMoves()
+            self.updateBitboards(move)
+
+    # Toggle the squares a move changes, the same call makes and takes back a move
+    def updateBitboards(self, move):
+        bitboards = self.bitboards
+        start = 1 << (move.start_row * 8 + move.start_col)
+        end = 1 << (move.end_row * 8 + move.end_col)
+        if move.is_pawn_promotion:
+            bitboards[move.piece_moved] ^= start
+            bitboards[move.piece_moved[0] + move.promotion_piece] ^= end
+        else:
+            bitboards[move.piece_moved] ^= start | end
+        if move.is_enpassant_move:
+            bitboards[move.piece_captured] ^= 1 << (move.start_row * 8 + move.end_col)
+        elif move.piece_captured != "-":
+            bitboards[move.piece_captured] ^= end
+        if move.is_castle_move:
+            row = move.end_row * 8
+            if move.end_col - move.start_col == 2:  # king side
+                bitboards[move.piece_moved[0] + "R"] ^= 1 << (row + move.end_col + 1) | 1 << (row + move.end_col - 1)
+            else:
+                bitboards[move.piece_moved[0] + "R"] ^= 1 << (row + move.end_col - 2) | 1 << (row + move.end_col + 1)
+
+    def colorOccupancy(self, color):
+        bitboards = self.bitboards
+        return bitboards[color + "p"] | bitboards[color + "R"] | bitboards[color + "N"] | \
+            bitboards[color + "B"] | bitboards[color + "Q"] | bitboards[color + "K"]
+
+    # Pieces of color attacking sq, pieces missing from occupied are treated as gone
+    def attackersTo(self, sq, color, occupied):
+        bitboards = self.bitboards
+        queens = bitboards[color + "Q"]
+        attackers = (knight_attacks[sq] & bitboards[color + "N"]) | \
+            (king_attacks[sq] & bitboards[color + "K"]) | \
+            (pawn_attacks["b" if color == "w" else "w"][sq] & bitboards[color + "p"])
+        # the sliding attacks are only worked out when a slider stands somewhere on those lines
+        sliders = rook_masks[sq] & (bitboards[color + "R"] | queens)
+        if sliders:
+            attackers |= rookAttacks(sq, occupied) & sliders
+        sliders = bishop_masks[sq] & (bitboards[color + "B"] | queens)
+        if sliders:
+            attackers |= bishopAttacks(sq, occupied) & sliders
+        return attackers & occupied
+
+    def squareUnderAttack(self, row, col, ally_color):
+        enemy_color = "w" if ally_color == "b" else "b"
+        occupied = self.colorOccupancy("w") | self.colorOccupancy("b")
+        return self.attackersTo(row * 8 + col, enemy_color, occupied) != 0
+
+    def getValidMoves(self):
+        moves = self.generateMoves()
+        if len(moves) == 0:
+            self.check_mate = self.in_check
+            self.stale_mate = not self.in_check
+        else:
+            self.check_mate = False
+            self.stale_mate = False
+        return moves
+
+    # Legal captures only, used by the quiescence search. In check every evasion is returned instead.
+    def getValidCaptures(self):
+        moves = self.generateMoves(captures_only=True)
+        # in check the evasions came back in full, so no moves is mate
+        self.check_mate = self.in_check and len(moves) == 0
+        self.stale_mate = False
+        return moves
+
+    # The staged generator of GameState only needs to know about check up front, the rest comes from generateMoves
+    def startMoveStages(self):
+        if self.white_to_move:
+            king_row, king_col = self.white_king_location
+            enemy_color = "b"
+        else:
+            king_row, king_col = self.black_king_location
+            enemy_color = "w"
+        occupied = self.colorOccupancy("w") | self.colorOccupancy("b")
+        self.in_check = self.attackersTo(king_row * 8 + king_col, enemy_color, occupied) != 0
+        return None
+
+    def getStageMoves(self, stage, captures_only=False, quiets_only=False):
+        return self.generateMoves(captures_only, quiets_only=quiets_only)
+
+    def getStagePieceMoves(self, stage, row, col):
+        return self.generateMoves(from_mask=1 << (row * 8 + col))
+
+    # Legal moves straight from the bitboards, no make/undo needed to filter them.
+    # from_mask limits them to the pieces standing on those squares, captures_only or quiets_only to one kind of move.
+    def generateMoves(self, captures_only=False, from_mask=ALL_SQUARES, quiets_only=False):
+        bitboards = self.bitboards
+        if self.white_to_move:
+            ally_color, enemy_color = "w", "b"
+            king_row, king_col = self.white_king_location
+        else:
+            ally_color, enemy_color = "b", "w"
+            king_row, king_col = self.black_king_location
+        king = king_row * 8 + king_col
+        ally_occupied = self.colorOccupancy(ally_color)
+        enemy_occupied = self.colorOccupancy(enemy_color)
+        occupied = ally_occupied | enemy_occupied
+
+        checkers = self.attackersTo(king, enemy_color, occupied)
+        self.in_check = checkers != 0
+        if checkers:
+            captures_only = quiets_only = False  # every evasion counts when in check
+        moves = []
+
+        # king moves, with the king lifted so it can't hide behind itself on a checking line
+        targets = king_attacks[king] & ~ally_occupied if from_mask >> king & 1 else 0
+        if captures_only:
+            targets &= enemy_occupied
+        elif quiets_only:
+            targets &= ~enemy_occupied
+        without_king = occupied ^ (1 << king)
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            end = bit.bit_length() - 1
+            if not self.attackersTo(end, enemy_color, without_king):
+                moves.append(Move((king_row, king_col), square_coords[end], self.board))
+        if checkers & (checkers - 1):
+            return moves  # double check, king has to move
+
+        # squares the other pieces may land on: anywhere, or on the checking line when in check
+        if checkers:
+            check_mask = between_masks[king][checkers.bit_length() - 1] | checkers
+        else:
+            check_mask = ALL_SQUARES
+        if captures_only:
+            target_mask = check_mask & enemy_occupied
+        elif quiets_only:
+            target_mask = check_mask & ~occupied
+        else:
+            target_mask = check_mask & ~ally_occupied
+
+        # a piece alone between the king and an enemy slider can only move along that line
+        pinned = 0
+        pin_lines = {}
+        enemy_queens = bitboards[enemy_color + "Q"]
+        snipers = (rook_masks[king] & (bitboards[enemy_color + "R"] | enemy_queens)) | \
+            (bishop_masks[king] & (bitboards[enemy_color + "B"] | enemy_queens))
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            sniper = bit.bit_length() - 1
+            blockers = between_masks[king][sniper] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & ally_occupied:
+                pinned |= blockers
+                pin_lines[blockers.bit_length() - 1] = line_masks[king][sniper]
+
+        # a pinned knight can never move
+        pieces = bitboards[ally_color + "N"] & ~pinned & from_mask
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            start = bit.bit_length() - 1
+            self.addMoves(start, knight_attacks[start] & target_mask, moves)
+
+        for piece in ("B", "R", "Q"):
+            pieces = bitboards[ally_color + piece] & from_mask
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                start = bit.bit_length() - 1
+                if piece == "B":
+                    attacks = bishopAttacks(start, occupied)
+                elif piece == "R":
+                    attacks = rookAttacks(start, occupied)
+                else:
+                    attacks = bishopAttacks(start, occupied) | rookAttacks(start, occupied)
+                attacks &= target_mask
+                if bit & pinned:
+                    attacks &= pin_lines[start]
+                self.addMoves(start, attacks, moves)
+
+        # unpinned pawns all at once, pinned ones one by one with their pin line as an extra mask
+        pawns = bitboards[ally_color + "p"] & from_mask
+        empty = ~occupied & ALL_SQUARES
+        self.addPawnMoves(pawns & ~pinned, ALL_SQUARES, check_mask, empty, enemy_occupied, captures_only, quiets_only, moves)
+        pinned_pawns = pawns & pinned
+        while pinned_pawns:
+            bit = pinned_pawns & -pinned_pawns
+            pinned_pawns ^= bit
+            self.addPawnMoves(bit, pin_lines[bit.bit_length() - 1], check_mask, empty, enemy_occupied, captures_only, quiets_only, moves)
+
+        # en passant, tried on the board since it takes two pieces off the same rank at once
+        if self.enpassant_possible and not quiets_only:
+            target = self.enpassant_possible[0] * 8 + self.enpassant_possible[1]
+            captured = target + 8 if self.white_to_move else target - 8
+            capturers = pawn_attacks[enemy_color][target] & pawns
+            while capturers:
+                bit = capturers & -capturers
+                capturers ^= bit
+                after = (occupied ^ bit ^ (1 << captured)) | 1 << target
+                if not self.attackersTo(king, enemy_color, after):
+                    moves.append(Move(square_coords[bit.bit_length() - 1], square_coords[target], self.board,
+                                      is_enpassant_move=True))
+
+        if not captures_only and not checkers and from_mask >> king & 1:
+            self.addCastleMoves(king, ally_color, enemy_color, occupied, moves)
+
+        return moves
+
+    def addMoves(self, start, targets, moves):
+        start_square = square_coords[start]
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            moves.append(Move(start_square, square_coords[bit.bit_length() - 1], self.board))
+
+    # Pawn moves by shifting the whole set, offset is how far a target square is from its pawn
+    def addPawnMoves(self, pawns, pin_mask, check_mask, empty, enemy_occupied, captures_only, quiets_only, moves):
+        if not pawns:
+            return
+        mask = pin_mask & check_mask
+        if self.white_to_move:
+            push = (pawns >> 8) & empty
+            double_push = ((push & ROW_5) >> 8) & empty
+            shifted = (((pawns & ~COL_0) >> 9, 9), ((pawns & ~COL_7) >> 7, 7))
+            push_offset = 8
+        else:
+            push = ((pawns << 8) & ALL_SQUARES) & empty
+            double_push = ((push & ROW_2) << 8) & empty
+            shifted = ((((pawns & ~COL_0) << 7) & ALL_SQUARES, -7), (((pawns & ~COL_7) << 9) & ALL_SQUARES, -9))
+            push_offset = -8
+        if not captures_only:
+            self.addPawnTargets(push & mask, push_offset, moves)
+            self.addPawnTargets(double_push & mask, push_offset * 2, moves)
+        if not quiets_only:
+            for captures, offset in shifted:
+                self.addPawnTargets(captures & enemy_occupied & mask, offset, moves)
+
+    def addPawnTargets(self, targets, offset, moves):
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            end = bit.bit_length() - 1
+            self.addPawnMove(square_coords[end + offset], square_coords[end], moves)
+
+    def addCastleMoves(self, king, ally_color, enemy_color, occupied, moves):
+        rights = self.current_castle_rights
+        if ally_color == "w":
+            king_side, queen_side = rights & WHITE_KING_SIDE, rights & WHITE_QUEEN_SIDE
+        else:
+            king_side, queen_side = rights & BLACK_KING_SIDE, rights & BLACK_QUEEN_SIDE
+        king_square = square_coords[king]
+        if king_side and not occupied & (0b11 << (king + 1)):
+            if not self.attackersTo(king + 1, enemy_color, occupied) and not self.attackersTo(king + 2, enemy_color, occupied):
+                moves.append(Move(king_square, square_coords[king + 2], self.board, is_castle_move=True))
+        if queen_side and not occupied & (0b111 << (king - 3)):
+            if not self.attackersTo(king - 1, enemy_color, occupied) and not self.attackersTo(king - 2, enemy_color, occupied):
+                moves.append(Move(king_square, square_coords[king - 2], self.board, is_castle_move=True))
@@ -1,3 +1,60 @@
+import random
+from ChessScores import piece_square_values
+
+# Zobrist keys used to identify a position, seeded so every process builds the same keys
+zobrist_random = random.Random(2023)
+zobrist_pieces = {
+    piece: [[zobrist_random.getrandbits(64) for col in range(8)] for row in range(8)]
+    for piece in ("wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK")
+}
+zobrist_black_to_move = zobrist_random.getrandbits(64)
+zobrist_castle_rights = [zobrist_random.getrandbits(64) for i in range(16)]
+zobrist_enpassant = [zobrist_random.getrandbits(64) for col in range(8)]
+
+# Attack tables built once: for every square the squares a piece there can reach, so the
+# attack and pin checks walk lists instead of testing board bounds on every step.
+# The first four directions are the rook lines and the last four the bishop diagonals.
+directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+knight_offsets = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+
+def buildRay(row, col, d):
+    ray = []
+    end_row, end_col = row + d[0], col + d[1]
+    while 0 <= end_row < 8 and 0 <= end_col < 8:
+        ray.append((end_row, end_col))
+        end_row, end_col = end_row + d[0], end_col + d[1]
+    return tuple(ray)
+
+def buildJumps(row, col, offsets):
+    return tuple((row + m[0], col + m[1]) for m in offsets if 0 <= row + m[0] < 8 and 0 <= col + m[1] < 8)
+
+# ray_squares[row][col][j] runs outward from (row, col) along directions[j] up to the edge
+ray_squares = [[tuple(buildRay(row, col, d) for d in directions) for col in range(8)] for row in range(8)]
+knight_squares = [[buildJumps(row, col, knight_offsets) for col in range(8)] for row in range(8)]
+king_squares = [[buildJumps(row, col, directions) for col in range(8)] for row in range(8)]
+# one shared (row, col) tuple per square, so makeMove doesn't build new ones for king and en passant squares
+square_tuples = [[(row, col) for col in range(8)] for row in range(8)]
+
+# castling rights are the bits of one int, which is also the index of their zobrist key
+WHITE_KING_SIDE = 1
+BLACK_KING_SIDE = 2
+WHITE_QUEEN_SIDE = 4
+BLACK_QUEEN_SIDE = 8
+ALL_CASTLE_RIGHTS = 15
+# rights kept when a piece moves from or to a square, only the king and rook corners clear any
+castle_rights_masks = [[ALL_CASTLE_RIGHTS] * 8 for row in range(8)]
+castle_rights_masks[7][4] = ALL_CASTLE_RIGHTS & ~(WHITE_KING_SIDE | WHITE_QUEEN_SIDE)
+castle_rights_masks[0][4] = ALL_CASTLE_RIGHTS & ~(BLACK_KING_SIDE | BLACK_QUEEN_SIDE)
+castle_rights_masks[7][7] = ALL_CASTLE_RIGHTS & ~WHITE_KING_SIDE
+castle_rights_masks[7][0] = ALL_CASTLE_RIGHTS & ~WHITE_QUEEN_SIDE
+castle_rights_masks[0][7] = ALL_CASTLE_RIGHTS & ~BLACK_KING_SIDE
+castle_rights_masks[0][0] = ALL_CASTLE_RIGHTS & ~BLACK_QUEEN_SIDE
+
+# The undo stack holds, for every ply, the state a move can't give back by itself:
+# castling rights, en passant square, position key and score before the move. The captured piece is on the Move.
+UNDO_FIELDS = 4
+UNDO_STACK_PLIES = 512
+
 
 class GameState():
 
@@ -30,12 +87,39 @@ class GameState():
         self.stale_mate = False
         # coordinates for the square where an enpassant capture is possible
         self.enpassant_possible = ()
-        self.enpassant_possible_log = [self.enpassant_possible]
-        self.current_castle_rights = CastleRights(True, True, True, True)
-        self.castle_rights_log = [CastleRights(self.current_castle_rights.wks, self.current_castle_rights.bks,
-                                               self.current_castle_rights.wqs, self.current_castle_rights.bqs)]
+        self.current_castle_rights = ALL_CASTLE_RIGHTS
+        # 64-bit position key, updated incrementally by makeMove and restored by undoMoves
+        self.zobrist_key = self.computeZobristKey()
+        # material + positional score in tenths of a pawn (positive is good for white), kept up to date like the key
+        self.board_score = self.computeBoardScore()
+        # allocated once, makeMove and undoMoves only overwrite and read entries
+        self.undo_stack = [0] * (UNDO_STACK_PLIES * UNDO_FIELDS)
+        # pieces on the board, kings included, so the AI knows when an endgame table applies
+        self.piece_count = 32
 
     def makeMove(self, move):
+        # save what undoMoves can't work out from the move
+        undo_index = len(self.moveLog) * UNDO_FIELDS
+        undo_stack = self.undo_stack
+        if undo_index == len(undo_stack):
+            undo_stack.extend([0] * len(undo_stack))  # only games longer than the stack ever get here
+        undo_stack[undo_index] = self.current_castle_rights
+        undo_stack[undo_index + 1] = self.enpassant_possible
+        undo_stack[undo_index + 2] = self.zobrist_key
+        undo_stack[undo_index + 3] = self.board_score
+
+        key = self.zobrist_key
+        key ^= zobrist_pieces[move.piece_moved][move.start_row][move.start_col]
+        if move.piece_captured != "-" and not move.is_enpassant_move:
+            key ^= zobrist_pieces[move.piece_captured][move.end_row][move.end_col]
+        key ^= zobrist_black_to_move
+        if self.enpassant_possible:
+            key ^= zobrist_enpassant[self.enpassant_possible[1]]
+        key ^= zobrist_castle_rights[self.current_castle_rights]
+        score = self.board_score - piece_square_values[move.piece_moved][move.start_row][move.start_col]
+        if move.piece_captured != "-" and not move.is_enpassant_move:
+            score -= piece_square_values[move.piece_captured][move.end_row][move.end_col]
+
         self.board[move.end_row][move.end_col] = move.piece_moved
         self.board[move.start_row][move.start_col] = "-"
         self.moveLog.append(move)  # log the move for undo
@@ -43,13 +127,14 @@ class GameState():
 
         # update the king's location if moved
         if move.piece_moved == "wK":
-            self.white_king_location = (move.end_row, move.end_col)
+            self.white_king_location = square_tuples[move.end_row][move.end_col]
         elif move.piece_moved == "bK":
-            self.black_king_location = (move.end_row, move.end_col)
+            self.black_king_location = square_tuples[move.end_row][move.end_col]
 
         # update enpassant possible variable
         if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2:
-            self.enpassant_possible = ((move.start_row + move.end_row)//2, move.end_col)
+            self.enpassant_possible = square_tuples[(move.start_row + move.end_row)//2][move.end_col]
+            key ^= zobrist_enpassant[move.end_col]
         else:
             self.enpassant_possible = ()
 
@@ -57,12 +142,16 @@ class GameState():
         if move.is_enpassant_move:
             # capturing the pawn
             self.board[move.start_row][move.end_col] = "-"
+            key ^= zobrist_pieces[move.piece_captured][move.start_row][move.end_col]
+            score -= piece_square_values[move.piece_captured][move.start_row][move.end_col]
 
         # pawn promotion
         if move.is_pawn_promotion:
             #promote_piece = input('Promote to Q, R, B, or N:')
-            promote_piece = "Q"
+            promote_piece = move.promotion_piece
             self.board[move.end_row][move.end_col] = move.piece_moved[0] + promote_piece
+        key ^= zobrist_pieces[self.board[move.end_row][move.end_col]][move.end_row][move.end_col]
+        score += piece_square_values[self.board[move.end_row][move.end_col]][move.end_row][move.end_col]
 
         # castle move
         if move.is_castle_move:
@@ -70,16 +159,24 @@ class GameState():
                 # moves the rook
                 self.board[move.end_row][move.end_col-1] = self.board[move.end_row][move.end_col+1]
                 self.board[move.end_row][move.end_col+1] = "-"
+                rook = self.board[move.end_row][move.end_col-1]
+                key ^= zobrist_pieces[rook][move.end_row][move.end_col+1] ^ zobrist_pieces[rook][move.end_row][move.end_col-1]
+                score += piece_square_values[rook][move.end_row][move.end_col-1] - piece_square_values[rook][move.end_row][move.end_col+1]
             else:
                 self.board[move.end_row][move.end_col+1] = self.board[move.end_row][move.end_col-2]
                 self.board[move.end_row][move.end_col-2] = "-"
-
-        self.enpassant_possible_log.append(self.enpassant_possible)
+                rook = self.board[move.end_row][move.end_col+1]
+                key ^= zobrist_pieces[rook][move.end_row][move.end_col-2] ^ zobrist_pieces[rook][move.end_row][move.end_col+1]
+                score += piece_square_values[rook][move.end_row][move.end_col+1] - piece_square_values[rook][move.end_row][move.end_col-2]
 
         # update castling rights
         self.updateCastleRights(move)
-        self.castle_rights_log.append(CastleRights(self.current_castle_rights.wks, self.current_castle_rights.bks,
-                                                   self.current_castle_rights.wqs, self.current_castle_rights.bqs))
+        key ^= zobrist_castle_rights[self.current_castle_rights]
+
+        self.zobrist_key = key
+        self.board_score = score
+        if move.piece_captured != "-":
+            self.piece_count -= 1
 
     def undoMoves(self):
 
@@ -91,9 +188,9 @@ class GameState():
 
             # update the king's location if moved
             if move.piece_moved == "wK":
-                self.white_king_location = (move.start_row, move.start_col)
+                self.white_king_location = square_tuples[move.start_row][move.start_col]
             elif move.piece_moved == "bK":
-                self.black_king_location = (move.start_row, move.start_col)
+                self.black_king_location = square_tuples[move.start_row][move.start_col]
 
             # undo en passant
             if move.is_enpassant_move:
@@ -101,12 +198,15 @@ class GameState():
                 self.board[move.end_row][move.end_col] = "-"
                 self.board[move.start_row][move.end_col] = move.piece_captured
                 
-            self.enpassant_possible_log.pop()
-            self.enpassant_possible = self.enpassant_possible_log[-1] 
-
-            # undo castle rights
-            self.castle_rights_log.pop()
-            self.current_castle_rights = self.castle_rights_log[-1]
+            # restore castle rights, en passant square, position key and score saved by makeMove
+            undo_index = len(self.moveLog) * UNDO_FIELDS
+            undo_stack = self.undo_stack
+            self.current_castle_rights = undo_stack[undo_index]
+            self.enpassant_possible = undo_stack[undo_index + 1]
+            self.zobrist_key = undo_stack[undo_index + 2]
+            self.board_score = undo_stack[undo_index + 3]
+            if move.piece_captured != "-":
+                self.piece_count += 1
 
             # undo castle move
             if move.is_castle_move:
@@ -120,6 +220,74 @@ class GameState():
             self.check_mate = False
             self.stale_mate = False
 
+    # Set up the position described by a FEN string, the move history is cleared
+    def loadFen(self, fen):
+        fields = fen.split()
+        self.board = []
+        for rank in fields[0].split("/"):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(["-"] * int(char))
+                else:
+                    color = "w" if char.isupper() else "b"
+                    row.append(color + ("p" if char.lower() == "p" else char.upper()))
+            self.board.append(row)
+
+        for row in range(8):
+            for col in range(8):
+                if self.board[row][col] == "wK":
+                    self.white_king_location = square_tuples[row][col]
+                elif self.board[row][col] == "bK":
+                    self.black_king_location = square_tuples[row][col]
+
+        self.white_to_move = len(fields) < 2 or fields[1] == "w"
+        castling = fields[2] if len(fields) > 2 else "-"
+        self.current_castle_rights = 0
+        for char, right in (("K", WHITE_KING_SIDE), ("k", BLACK_KING_SIDE), ("Q", WHITE_QUEEN_SIDE), ("q", BLACK_QUEEN_SIDE)):
+            if char in castling:
+                self.current_castle_rights |= right
+        enpassant = fields[3] if len(fields) > 3 else "-"
+        if enpassant != "-":
+            self.enpassant_possible = square_tuples[Move.ranks_to_rows[enpassant[1]]][Move.files_to_cols[enpassant[0]]]
+        else:
+            self.enpassant_possible = ()
+
+        self.moveLog = []
+        self.in_check = False
+        self.pins = []
+        self.checks = []
+        self.check_mate = False
+        self.stale_mate = False
+        self.zobrist_key = self.computeZobristKey()
+        self.board_score = self.computeBoardScore()
+        self.piece_count = sum(1 for row in self.board for piece in row if piece != "-")
+
+    # Hash the whole position from scratch, makeMove keeps the key up to date incrementally
+    def computeZobristKey(self):
+        key = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "-":
+                    key ^= zobrist_pieces[piece][row][col]
+        if not self.white_to_move:
+            key ^= zobrist_black_to_move
+        if self.enpassant_possible:
+            key ^= zobrist_enpassant[self.enpassant_possible[1]]
+        key ^= zobrist_castle_rights[self.current_castle_rights]
+        return key
+
+    # Sum the value of every piece from scratch, makeMove keeps the score up to date incrementally
+    def computeBoardScore(self):
+        score = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "-":
+                    score += piece_square_values[piece][row][col]
+        return score
+
     def getValidMoves(self):
         moves = []
         self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
@@ -152,22 +320,20 @@ class GameState():
                         # once you get to piece end checks
                         if valid_square[0] == check_row and valid_square[1] == check_col:
                             break
-                # get rid of any moves that don't block check or move king
-                # go through backwards when you are removing from a list an iterating
-                for i in range(len(moves) - 1, -1,  -1):
-                    if moves[i].piece_moved[1] != "K":
-                        if not (moves[i].end_row, moves[i].end_col) in valid_squares:
-                            moves.remove(moves[i])
+                # keep only the moves that block check or move king, in one pass instead of removing one by one
+                # en passant removes the checking pawn without landing on its square
+                moves = [move for move in moves if move.piece_moved[1] == "K" or
+                         (move.end_row, move.end_col) in valid_squares or
+                         (move.is_enpassant_move and move.start_row == check_row and move.end_col == check_col)]
             else:  # double check, king has to move
                 self.getKingMoves(king_row, king_col, moves)
         else:
             moves = self.getAllPossibleMoves()
 
         if len(moves) == 0:
-            if self.in_check:
-                self.check_mate = True
-            else:
-                self.stale_mate = True
+            # both flags are set, a reused GameState may still hold the other one from an earlier position
+            self.check_mate = self.in_check
+            self.stale_mate = not self.in_check
         else:
             self.check_mate = False
             self.stale_mate = False
@@ -176,43 +342,120 @@ class GameState():
 
     def squareUnderAttack(self, row, col, ally_color):
         enemy_color = 'w' if ally_color == 'b' else 'b'
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            d = directions[j]
-            for i in range(1, 8):
-                end_row = row + d[0] * i
-                end_col = col + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] == ally_color:
-                        break
-                    elif end_piece[0] == enemy_color:
-                        type = end_piece[1]
-
-                        if(0 <= j <= 3 and type == 'R') or \
-                            (4 <=j <= 7 and type == 'B') or \
-                                (i == 1 and type == 'p' and (
-                                    (enemy_color == 'w' and 6 <= j <= 7) or (enemy_color == 'b' and 4 <= j <= 5))) or \
-                                        (type == 'Q') or (i == 1 and type == 'K'):
-                            return True
-                        else: # enemy piece not applying check
-                            break
-                else:
-                    break # off board
+        board = self.board
+        rays = ray_squares[row][col]
+        for j in range(8):
+            i = 0
+            for end_row, end_col in rays[j]:
+                i += 1
+                end_piece = board[end_row][end_col]
+                if end_piece == "-":
+                    continue
+                if end_piece[0] == enemy_color:
+                    type = end_piece[1]
+                    if (j <= 3 and type == 'R') or (j >= 4 and type == 'B') or type == 'Q' or \
+                            (i == 1 and (type == 'K' or (type == 'p' and (
+                                (enemy_color == 'w' and j >= 6) or (enemy_color == 'b' and 4 <= j <= 5))))):
+                        return True
+                break  # friendly piece or enemy piece not attacking along this line
         # check for knight checks
-        knight_moves = [(-2, -1),(-2, 1),(-1, -2),(-1, 2),(1, -2),(1, 2),(2, -1),(2, 1)]
-        for m in knight_moves:
-            end_row = row + m[0]
-            end_col = col + m[1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] == enemy_color and end_piece[1] == 'N':
-                    return True
-        
+        for end_row, end_col in knight_squares[row][col]:
+            end_piece = board[end_row][end_col]
+            if end_piece[0] == enemy_color and end_piece[1] == 'N':
+                return True
+
         return False
 
-    # All moves without considering checks
-    def getAllPossibleMoves(self):
+    # Legal captures only, used by the quiescence search. In check every evasion is returned instead.
+    def getValidCaptures(self):
+        self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
+        if self.in_check:
+            return self.getValidMoves()
+        self.check_mate = False
+        self.stale_mate = False
+        return self.getAllPossibleMoves(captures_only=True)
+
+    # Legal moves handed out one stage at a time: the hash move, captures, killer moves, then quiet moves.
+    # A stage is only generated once the ones before it are used up, so a node that cuts off early skips the rest.
+    # The caller may make and undo moves in between, so the pins and checks are kept here and put back each stage.
+    def generateStagedMoves(self, hash_move_ID=None, killer_IDs=(), capture_order=None, quiet_order=None):
+        self.check_mate = False
+        self.stale_mate = False
+        stage = self.startMoveStages()
+        in_check = self.in_check
+        # evasions are few, so in check they are all generated at once and only handed out in stage order
+        evasions = self.getValidMoves() if in_check else None
+        used_IDs = set()
+
+        if hash_move_ID is not None:
+            move = self.findStageMove(stage, evasions, hash_move_ID)
+            if move is not None:
+                used_IDs.add(hash_move_ID)
+                yield move
+
+        if evasions is not None:
+            captures = [move for move in evasions if move.is_capture]
+        else:
+            captures = self.getStageMoves(stage, captures_only=True)
+        if capture_order is not None:
+            captures.sort(key=capture_order, reverse=True)
+        for move in captures:
+            if move.move_ID != hash_move_ID:
+                used_IDs.add(move.move_ID)
+                yield move
+
+        for killer_ID in killer_IDs:
+            if killer_ID is not None and killer_ID not in used_IDs:
+                move = self.findStageMove(stage, evasions, killer_ID)
+                if move is not None and not move.is_capture:
+                    used_IDs.add(killer_ID)
+                    yield move
+
+        if evasions is not None:
+            quiets = [move for move in evasions if not move.is_capture and move.move_ID not in used_IDs]
+        else:
+            quiets = [move for move in self.getStageMoves(stage, quiets_only=True) if move.move_ID not in used_IDs]
+        if quiet_order is not None:
+            quiets.sort(key=quiet_order, reverse=True)
+        for move in quiets:
+            used_IDs.add(move.move_ID)
+            yield move
+
+        if len(used_IDs) == 0:
+            self.check_mate = in_check
+            self.stale_mate = not in_check
+
+    # Work out what every stage needs about the position, returned so it can be put back between stages
+    def startMoveStages(self):
+        self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
+        return (self.in_check, self.pins, self.checks)
+
+    # Legal captures, legal non-captures or all legal moves when not in check
+    def getStageMoves(self, stage, captures_only=False, quiets_only=False):
+        self.in_check, self.pins, self.checks = stage
+        return self.getAllPossibleMoves(captures_only, quiets_only)
+
+    # Legal moves of the piece on one square when not in check
+    def getStagePieceMoves(self, stage, row, col):
+        self.in_check, self.pins, self.checks = stage
+        moves = []
+        piece = self.board[row][col]
+        if piece[0] == ("w" if self.white_to_move else "b"):
+            self.move_functions[piece[1]](row, col, moves)
+        return moves
+
+    # The legal move with this ID, None when a stored move doesn't fit the position
+    def findStageMove(self, stage, evasions, move_ID):
+        if evasions is None:
+            start = move_ID & 63
+            evasions = self.getStagePieceMoves(stage, start // 8, start % 8)
+        for move in evasions:
+            if move.move_ID == move_ID:
+                return move
+        return None
+
+    # All moves without considering checks, or only the captures or only the non-captures
+    def getAllPossibleMoves(self, captures_only=False, quiets_only=False):
         moves = []
         for row in range(len(self.board)):  # number of rows
             # number of cols in given row
@@ -221,11 +464,11 @@ class GameState():
 
                 if (turn == 'w' and self.white_to_move) or (turn == 'b' and not self.white_to_move):
                     piece = self.board[row][col][1]
-                    self.move_functions[piece](row, col, moves)
+                    self.move_functions[piece](row, col, moves, captures_only, quiets_only)
 
         return moves
 
-    def getPawnMoves(self, row, col, moves):
+    def getPawnMoves(self, row, col, moves, captures_only=False, quiets_only=False):
 
         piece_pinned = False
         pin_direction = ()
@@ -234,9 +477,8 @@ class GameState():
             if self.pins[i][0] == row and self.pins[i][1] == col:
                 piece_pinned = True
                 pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
                 break
-            
+
         if self.white_to_move:
             move_amount = -1
             start_row = 6
@@ -248,15 +490,17 @@ class GameState():
             enemy_color = "w"
             king_row, king_col = self.black_king_location
 
-        if self.board[row + move_amount][col] == "-":
+        if self.board[row + move_amount][col] == "-" and not captures_only:
             if not piece_pinned or pin_direction == (move_amount, 0):
-                moves.append(Move((row, col), (row + move_amount, col), self.board))
+                self.addPawnMove((row, col), (row + move_amount, col), moves)
                 if row == start_row and self.board[row+2 * move_amount][col] == "-":
                     moves.append(Move((row, col), (row+2 * move_amount, col), self.board))
+        if quiets_only:
+            return
         if col-1 >= 0:
             if not piece_pinned or pin_direction == (move_amount, -1):
                 if self.board[row + move_amount][col-1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col-1), self.board))
+                    self.addPawnMove((row, col), (row + move_amount, col-1), moves)
                 if (row + move_amount, col-1) == self.enpassant_possible:
                     attacking_piece = blocking_piece = False
                     if king_row == row:
@@ -274,14 +518,16 @@ class GameState():
                             square = self.board[row][i]
                             if square[0] == enemy_color and (square[1] == 'R' or square[1] == 'Q'):
                                 attacking_piece = True
+                                break
                             elif square != "-":
                                 blocking_piece = True
+                                break
                     if not attacking_piece or blocking_piece:        
                         moves.append(Move((row, col), (row + move_amount, col-1), self.board, is_enpassant_move=True))
         if col+1 <= 7: #capture to right
             if not piece_pinned or pin_direction == (move_amount, 1):
                 if self.board[row + move_amount][col+1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col+1), self.board))
+                    self.addPawnMove((row, col), (row + move_amount, col+1), moves)
                 if (row + move_amount, col+1) == self.enpassant_possible: 
                     attacking_piece = blocking_piece = False
                     if king_row == row:
@@ -299,160 +545,123 @@ class GameState():
                             square = self.board[row][i]
                             if square[0] == enemy_color and (square[1] == 'R' or square[1] == 'Q'):
                                 attacking_piece = True
+                                break
                             elif square != "-":
                                 blocking_piece = True
+                                break
                     if not attacking_piece or blocking_piece:                   
                         moves.append(Move((row, col), (row + move_amount, col+1), self.board, is_enpassant_move=True))
 
-    def getRookMoves(self, row, col, moves):
+    # Add a pawn move, or one move per piece the pawn can promote to on the last rank
+    def addPawnMove(self, start_square, end_square, moves):
+        if end_square[0] == 0 or end_square[0] == 7:
+            for promotion_piece in ("Q", "R", "B", "N"):
+                moves.append(Move(start_square, end_square, self.board, promotion_piece=promotion_piece))
+        else:
+            moves.append(Move(start_square, end_square, self.board))
+
+    def getRookMoves(self, row, col, moves, captures_only=False, quiets_only=False):
 
         piece_pinned = False
         pin_direction = ()
         for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][0] == col:
+            if self.pins[i][0] == row and self.pins[i][1] == col:
                 piece_pinned = True
                 pin_direction = (self.pins[i][2], self.pins[i][3])
-                if self.board[row][col][1] != "Q":
-                    self.pins.remove(self.pins[i])
                 break
 
-        directions = (
-            (-1, 0),  # up
-            (0, -1),  # left
-            (1, 0),  # down
-            (0, 1),  # right
-        )
         enemy_color = "b" if self.white_to_move else "w"
-
-        for d in directions:
-            for i in range(1, 8):
-                end_row = row + d[0] * i
-                end_col = col + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "-":  # empty space
-                            moves.append(
-                                Move((row, col), (end_row, end_col), self.board))
-                        elif end_piece[0] == enemy_color:
-                            moves.append(
-                                Move((row, col), (end_row, end_col), self.board))
-                            break
-                        else:  # friendly piece invalid move
-                            break
-                else:  # off board
+        rays = ray_squares[row][col]
+        for j in range(4):  # up, left, down, right
+            d = directions[j]
+            if piece_pinned and pin_direction != d and pin_direction != (-d[0], -d[1]):
+                continue
+            for end_row, end_col in rays[j]:
+                end_piece = self.board[end_row][end_col]
+                if end_piece == "-":  # empty space
+                    if not captures_only:
+                        moves.append(Move((row, col), (end_row, end_col), self.board))
+                elif end_piece[0] == enemy_color:
+                    if not quiets_only:
+                        moves.append(Move((row, col), (end_row, end_col), self.board))
+                    break
+                else:  # friendly piece invalid move
                     break
 
-    def getNightMoves(self, row, col, moves):
+    def getNightMoves(self, row, col, moves, captures_only=False, quiets_only=False):
 
-        piece_pinned = False
+        # pins are only read, never removed, so a piece's moves can be generated again in a later stage
         for i in range(len(self.pins) - 1, -1, -1):
             if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                self.pins.remove(self.pins[i])
-                break
-
-        knight_moves = (
-            (-2, -1),
-            (-2, 1),
-            (-1, -2),
-            (-1, 2),
-            (1, -2),
-            (1, 2),
-            (2, -1),
-            (2, 1),
-        )
+                return  # a pinned knight can never move
 
         ally_color = "w" if self.white_to_move else "b"
-        for m in knight_moves:
-            end_row = row + m[0]
-            end_col = col + m[1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                if not piece_pinned:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] != ally_color:
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
+        for end_row, end_col in knight_squares[row][col]:
+            end_piece = self.board[end_row][end_col]
+            if end_piece[0] != ally_color and not (captures_only and end_piece == "-") and not (quiets_only and end_piece != "-"):
+                moves.append(Move((row, col), (end_row, end_col), self.board))
 
-    def getBishopMoves(self, row, col, moves):
+    def getBishopMoves(self, row, col, moves, captures_only=False, quiets_only=False):
 
         piece_pinned = False
         pin_direction = ()
 
-        for i in range(len(self.pins) - 1, -1, 1):
+        for i in range(len(self.pins) - 1, -1, -1):
             if self.pins[i][0] == row and self.pins[i][1] == col:
                 piece_pinned = True
                 pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
                 break
 
-        directions = (
-            (-1, -1),  # up-left
-            (-1, 1),  # up-right
-            (1, -1),  # down-left
-            (1, 1),  # down-right
-        )
         enemy_color = "b" if self.white_to_move else "w"
-        for d in directions:
-            for i in range(1, 8):
-                end_row = row + d[0] * i
-                end_col = col + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "-":
-                            moves.append(
-                                Move((row, col), (end_row, end_col), self.board))
-                        elif end_piece[0] == enemy_color:
-                            moves.append(
-                                Move((row, col), (end_row, end_col), self.board))
-                            break
-                        else:
-                            break
-                else:
+        rays = ray_squares[row][col]
+        for j in range(4, 8):  # up-left, up-right, down-left, down-right
+            d = directions[j]
+            if piece_pinned and pin_direction != d and pin_direction != (-d[0], -d[1]):
+                continue
+            for end_row, end_col in rays[j]:
+                end_piece = self.board[end_row][end_col]
+                if end_piece == "-":  # empty space
+                    if not captures_only:
+                        moves.append(Move((row, col), (end_row, end_col), self.board))
+                elif end_piece[0] == enemy_color:
+                    if not quiets_only:
+                        moves.append(Move((row, col), (end_row, end_col), self.board))
+                    break
+                else:  # friendly piece invalid move
                     break
 
-    def getQueenMoves(self, row, col, moves):
+    def getQueenMoves(self, row, col, moves, captures_only=False, quiets_only=False):
 
-        self.getBishopMoves(row, col, moves)
-        self.getRookMoves(row, col, moves)
+        self.getBishopMoves(row, col, moves, captures_only, quiets_only)
+        self.getRookMoves(row, col, moves, captures_only, quiets_only)
 
-    def getKingMoves(self, row, col, moves):
+    def getKingMoves(self, row, col, moves, captures_only=False, quiets_only=False):
 
-        row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
         ally_color = "w" if self.white_to_move else "b"
-
-        for i in range(len(row_moves)):
-            end_row = row + row_moves[i]
-            end_col = col + col_moves[i]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color:
-                    # place king on end square and check for checks
-                    if ally_color == 'w':
-                        self.white_king_location = (end_row, end_col)
-                    else:
-                        self.black_king_location = (end_row, end_col)
-                    in_check, pins, checks = self.checkForPinsAndChecks()
-                    if not in_check:
-                        moves.append(
-                            Move((row, col), (end_row, end_col), self.board))
-                    # place king back on original position
-                    if ally_color == 'w':
-                        self.white_king_location = (row, col)
-                    else:
-                        self.black_king_location = (row, col)
-
-        self.getCastleMoves(row, col, moves, ally_color)
-          
+        # lift the king off its square so it doesn't shield the squares behind it from sliding attacks
+        king = self.board[row][col]
+        self.board[row][col] = "-"
+        safe_squares = []
+        for end_row, end_col in king_squares[row][col]:
+            end_piece = self.board[end_row][end_col]
+            if end_piece[0] != ally_color and not (captures_only and end_piece == "-") and not (quiets_only and end_piece != "-"):
+                if not self.squareUnderAttack(end_row, end_col, ally_color):
+                    safe_squares.append((end_row, end_col))
+        self.board[row][col] = king
+
+        for end_square in safe_squares:
+            moves.append(Move((row, col), end_square, self.board))
+
+        if not captures_only:
+            self.getCastleMoves(row, col, moves, ally_color)
 
     # Generate all valid castle moves for the king at (row, col) and add them to the list of moves
     def getCastleMoves(self, row, col, moves, ally_color):
         if self.in_check:
             return
-        if (self.white_to_move and self.current_castle_rights.wks) or (not self.white_to_move and self.current_castle_rights.bks):
+        if self.current_castle_rights & (WHITE_KING_SIDE if self.white_to_move else BLACK_KING_SIDE):
             self.getKingSideCastleMoves(row, col, moves, ally_color)
-        if (self.white_to_move and self.current_castle_rights.wqs) or (not self.white_to_move and self.current_castle_rights.bqs):
+        if self.current_castle_rights & (WHITE_QUEEN_SIDE if self.white_to_move else BLACK_QUEEN_SIDE):
             self.getQueenSideCastleMoves(row, col, moves, ally_color)
 
     def getKingSideCastleMoves(self, row, col, moves, ally_color):
@@ -482,106 +691,61 @@ class GameState():
             start_row = self.black_king_location[0]
             start_col = self.black_king_location[1]
         # check outward from king for pins and checks, keep track of pins
-        directions = [
-            (-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)
-        ]
-        for j in range(len(directions)):
-            d = directions[j]
+        board = self.board
+        rays = ray_squares[start_row][start_col]
+        for j in range(8):
             possible_pin = ()  # reset possible pins
-            for i in range(1, 8):
-                end_row = start_row + d[0] * i
-                end_col = start_col + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] == ally_color and end_piece[1] != "K":
-                        if possible_pin == ():
-                            possible_pin = (end_row, end_col, d[0], d[1])
-                        else:  # 2nd allied piece, so no pin or check possible in this direction
-                            break
-                    elif end_piece[0] == enemy_color:
-                        type = end_piece[1]
-                        if (0 <= j <= 3 and type == "R") or \
-                            (4 <= j <= 7 and type == "B") or \
-                            (i == 1 and type == 'p' and ((enemy_color == 'w' and 6 <= j <= 7) or (enemy_color == 'b' and 4 <= j <= 5))) or \
-                                (type == "Q") or (i == 1 and type == "K"):
-
-                            if possible_pin == ():  # no piece blocking, so check
-                                in_check = True
-                                checks.append((end_row, end_col, d[0], d[1]))
-                                break
-                            else:  # piece blocking so pin
-                                pins.append(possible_pin)
-                                break
-                        else:  # enemy piece not applying check
-                            break
-                else:
-                    break
+            i = 0
+            for end_row, end_col in rays[j]:
+                i += 1
+                end_piece = board[end_row][end_col]
+                if end_piece == "-":
+                    continue
+                if end_piece[0] == ally_color:
+                    if possible_pin == ():
+                        possible_pin = (end_row, end_col, directions[j][0], directions[j][1])
+                        continue
+                    break  # 2nd allied piece, so no pin or check possible in this direction
+                type = end_piece[1]
+                if (j <= 3 and type == "R") or (j >= 4 and type == "B") or type == "Q" or \
+                        (i == 1 and (type == "K" or (type == 'p' and (
+                            (enemy_color == 'w' and j >= 6) or (enemy_color == 'b' and 4 <= j <= 5))))):
+                    if possible_pin == ():  # no piece blocking, so check
+                        in_check = True
+                        checks.append((end_row, end_col, directions[j][0], directions[j][1]))
+                    else:  # piece blocking so pin
+                        pins.append(possible_pin)
+                break  # enemy piece ends the line whether it gives check or not
 
         # check for knight checks
-        knight_moves = [
-            (-2, -1),
-            (-2, 1),
-            (-1, -2),
-            (-1, 2),
-            (1, -2),
-            (1, 2),
-            (2, -1),
-            (2, 1),
-        ]
-
-        for m in knight_moves:
-            end_row = start_row + m[0]
-            end_col = start_col + m[1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-                # enemy knight attacking king
-                if end_piece[0] == enemy_color and end_piece[1] == "N":
-                    in_check = True
-                    checks.append((end_row, end_col, m[0], m[1]))
+        for end_row, end_col in knight_squares[start_row][start_col]:
+            end_piece = board[end_row][end_col]
+            # enemy knight attacking king
+            if end_piece[0] == enemy_color and end_piece[1] == "N":
+                in_check = True
+                checks.append((end_row, end_col, end_row - start_row, end_col - start_col))
 
         return in_check, pins, checks
 
+    # a king or rook leaving its square, or a rook captured on it, clears the rights that square takes part in
     def updateCastleRights(self, move):
-        if move.piece_moved == "wK":
-            self.current_castle_rights.wks = False
-            self.current_castle_rights.wqs = False
-        elif move.piece_moved == "bK":
-            self.current_castle_rights.bks = False
-            self.current_castle_rights.bqs = False
-        elif move.piece_moved == "wR":
-            if move.start_row == 7:
-                if move.start_col == 0:  # left rook
-                    self.current_castle_rights.wqs = False
-                elif move.start_col == 7:  # right rook
-                    self.current_castle_rights.wks = False
-        elif move.piece_moved == "bR":
-            if move.start_row == 0:
-                if move.start_col == 0:  # left rook
-                    self.current_castle_rights.bqs = False
-                if move.start_col == 7:  # right rook
-                    self.current_castle_rights.bks = False
-
-        # if a rook is captured
-        if move.piece_captured == 'wR':
-            if move.end_row == 7:
-                if move.end_col == 0:
-                    self.current_castle_rights.wqs = False
-                elif move.end_col == 7:
-                    self.current_castle_rights.wks = False
-        elif move.piece_captured == 'bR':
-            if move.end_row == 0:
-                if move.end_col == 0:
-                    self.current_castle_rights.bqs = False
-                elif move.end_col == 7:
-                    self.current_castle_rights.bks = False
-
-class CastleRights():
-
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
+        self.current_castle_rights &= castle_rights_masks[move.start_row][move.start_col] & \
+            castle_rights_masks[move.end_row][move.end_col]
+
+    # the pickle sent to the AI process leaves out the unused part of the undo stack and the bound move functions
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["move_functions"]
+        state["undo_stack"] = self.undo_stack[:len(self.moveLog) * UNDO_FIELDS]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.move_functions = {
+            "p": self.getPawnMoves, "R": self.getRookMoves, "N": self.getNightMoves,
+            "B": self.getBishopMoves, "Q": self.getQueenMoves, "K": self.getKingMoves
+        }
+        self.undo_stack.extend([0] * max(UNDO_STACK_PLIES * UNDO_FIELDS - len(self.undo_stack), 0))
 
 
 class Move():
@@ -597,34 +761,56 @@ class Move():
     }
     cols_to_files = {v: k for k, v in files_to_cols.items()}
 
-    def __init__(self, startSq, endSq, board, is_enpassant_move=False, is_castle_move=False):
-        self.start_row, self.start_col = startSq
-        self.end_row, self.end_col = endSq
-        self.piece_moved = board[self.start_row][self.start_col]
-        self.piece_captured = board[self.end_row][self.end_col]
+    # promotion field of the move ID, the queen is 0 so a move built from two clicks promotes to a queen
+    promotion_IDs = {"Q": 0, "R": 1, "B": 2, "N": 3}
+
+    # no per-move __dict__, the search creates hundreds of thousands of these
+    __slots__ = ("start_row", "start_col", "end_row", "end_col", "piece_moved", "piece_captured",
+                 "is_pawn_promotion", "promotion_piece", "is_enpassant_move", "is_castle_move", "move_ID")
+
+    def __init__(self, startSq, endSq, board, is_enpassant_move=False, is_castle_move=False, promotion_piece="Q"):
+        # locals instead of attribute reads, this runs for every generated move
+        start_row, start_col = startSq
+        end_row, end_col = endSq
+        self.start_row = start_row
+        self.start_col = start_col
+        self.end_row = end_row
+        self.end_col = end_col
+        self.piece_moved = piece_moved = board[start_row][start_col]
 
         # pawn_promotion
-        if len(self.piece_moved) > 1:
-            self.is_pawn_promotion = self.piece_moved[1] == "p" and (self.end_row == 0 or self.end_row == 7)
+        self.is_pawn_promotion = piece_moved[-1] == "p" and (end_row == 0 or end_row == 7)
+        self.promotion_piece = promotion_piece
 
         # en passant
         self.is_enpassant_move = is_enpassant_move
-        if self.is_enpassant_move:
-            self.piece_captured = "bp" if self.piece_moved == "wp" else "wp"
+        if is_enpassant_move:
+            self.piece_captured = "bp" if piece_moved == "wp" else "wp"
+        else:
+            self.piece_captured = board[end_row][end_col]
 
         self.is_castle_move = is_castle_move
 
-        self.is_capture = self.piece_captured != "-"
-        self.move_ID = self.start_row * 1000 + self.start_col * \
-            100 + self.end_row * 10 + self.end_col
+        # 16 bits: start square, end square and promotion piece, 6 + 6 + 4 bits
+        self.move_ID = (start_row * 8 + start_col) | (end_row * 8 + end_col) << 6 | self.promotion_IDs[promotion_piece] << 12
+
+    @property
+    def is_capture(self):
+        return self.piece_captured != "-"
 
     def __eq__(self, other) -> bool:
         if isinstance(other, Move):
             return self.move_ID == other.move_ID
         return False
 
+    def __hash__(self):
+        return self.move_ID
+
     def getChessNotation(self):
-        return self.getRankFile(self.start_row, self.start_col) + self.getRankFile(self.end_row, self.end_col)
+        notation = self.getRankFile(self.start_row, self.start_col) + self.getRankFile(self.end_row, self.end_col)
+        if self.is_pawn_promotion:
+            notation += self.promotion_piece.lower()
+        return notation
 
     def getRankFile(self, row, col):
         return self.cols_to_files[col] + self.rows_to_ranks[row]
@@ -639,9 +825,10 @@ class Move():
         #pawn moves
         if self.piece_moved[1] == "p":
             if self.is_capture:
-                return self.cols_to_files[self.start_col] + "x" + end_square
-            else:
-                return end_square
+                end_square = self.cols_to_files[self.start_col] + "x" + end_square
+            if self.is_pawn_promotion:
+                end_square += "=" + self.promotion_piece
+            return end_square
 
         #other
         move_string = self.piece_moved[1]
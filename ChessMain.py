@@ -1,12 +1,42 @@
+import math
+import time
 import pygame
 from const import *
 from ChessEngine import *
 import ChessAI
-from multiprocessing import Process, Queue
+from ChessWorker import EngineWorker
+from ChessProfiler import FrameProfiler
+from ChessBitboard import newGameState
 
 '''
 The main driver for our code. Handle use riput and updating the graphics
 '''
+
+# light and dark squares
+colors = [(234, 235, 200), (119, 154, 88)]
+PIECE_SCALE = .76  # share of a square a piece sprite covers
+AI_EVENT = pygame.USEREVENT  # a message from the AI process, in the event's message attribute
+AI_INFO_LINE_HEIGHT = 24  # lines at the bottom of the move log panel showing the running search
+
+# rendering caches, filled on first use so a frame is mostly blits
+board_surfaces = {}  # square size -> board with its coordinates
+piece_sprites = {}  # (piece, square size) -> scaled image
+highlight_surfaces = {}  # color -> translucent square
+fonts = {}
+profiler = FrameProfiler(PROFILE_CSV)
+
+def getFont(name):
+    if name not in fonts:
+        if name == "coordinates":
+            fonts[name] = pygame.font.SysFont('monospace', 18, bold=True)
+        elif name == "move_log":
+            fonts[name] = pygame.font.SysFont("Helvitca", 20, False, False)
+        elif name == "profiler":
+            fonts[name] = pygame.font.SysFont('monospace', 12)
+        else:  # "title"
+            fonts[name] = pygame.font.SysFont("Helvitca", 32, True, False)
+    return fonts[name]
+
 def main():
 
     is_menu = True
@@ -32,8 +62,8 @@ def main():
         pygame.display.set_caption('Chess')
         clock = pygame.time.Clock()
         screen.fill(pygame.Color("white"))
-        move_log_font = pygame.font.SysFont("Helvitca", 20, False, False)
-        gs = GameState()
+        move_log_font = getFont("move_log")
+        gs = newGameState()
         valid_moves = gs.getValidMoves()
         move_made = False
         animate = False
@@ -45,16 +75,49 @@ def main():
         game_over = False
         player_one = True # if a human is playing white, then this will be True. if an AI is playing , then this will be false
         AI_thinking = False
-        chess_AI_process = None
+        # the AI runs in one long-lived process that follows the game through the moves sent to it,
+        # its results come back as events so the loop can sleep while it thinks
+        engine = None
+        if not (player_one and player_two):
+            engine = EngineWorker(lambda message: pygame.event.post(
+                pygame.event.Event(AI_EVENT, message=message, posted=time.perf_counter())))
+        search_done = False
+        AI_move_ID = None
+        AI_info = None  # progress of the current or last search
+        show_stats = False  # 's' shows the statistics of the AI's last search under the move log
+        AI_stats = None
         move_undone = False
         motion = ()
+        last_frame = None  # what is on the screen, None redraws everything
+        animation = None  # (move, start time) while the last move slides into place
 
         while running:
             human_turn = (gs.white_to_move and player_one) or (not gs.white_to_move and player_two)
 
-            for e in pygame.event.get():
+            # nothing changes without an event, even the AI's move comes as one, so sleep until one comes
+            # unless a move is sliding or the AI has a search to start
+            if animation is not None or not (human_turn or game_over or AI_thinking or move_undone):
+                events = pygame.event.get()
+            else:
+                events = [pygame.event.wait()] + pygame.event.get()
+            profiler.mark("idle")
+
+            for e in events:
                 if e.type == pygame.QUIT:
                     running = False
+                elif e.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                    last_frame = None
+
+                # results of cancelled searches may still arrive, they are dropped
+                elif e.type == AI_EVENT:
+                    profiler.addSample("AI_latency", time.perf_counter() - e.posted)
+                    if AI_thinking and engine.isCurrentSearch(e.message[1]):
+                        if e.message[0] == "bestmove":
+                            search_done = True
+                            AI_move_ID = e.message[2]
+                            AI_stats = statsText(e.message[3]) if show_stats and e.message[3] is not None else None
+                        elif e.message[0] == "info":
+                            AI_info = infoText(*e.message[2:], valid_moves, gs.white_to_move)
 
                 # mouse handler
                 elif e.type == pygame.MOUSEBUTTONDOWN:
@@ -75,6 +138,8 @@ def main():
                             for i in range(len(valid_moves)):
                                 if move == valid_moves[i]:
                                     gs.makeMove(valid_moves[i])
+                                    if engine is not None:
+                                        engine.makeMove(valid_moves[i])
                                     move_made = True
                                     animate = True
                                     sq_selected = ()
@@ -85,81 +150,216 @@ def main():
                     motion_row = e.pos[1] // SQSIZE
                     motion_col = e.pos[0] // SQSIZE
 
-                    motion = (motion_row, motion_col)
+                    motion = (motion_row, motion_col) if motion_col < DIMENSIONS else ()
 
                 # key handlers
                 elif e.type == pygame.KEYDOWN:
                     if e.key == pygame.K_z:
                         gs.undoMoves()
+                        if engine is not None:
+                            engine.undoMove()
                         sq_selected = ()
                         player_clicks = []
                         move_made = True
                         animate = False
                         game_over = False
                         if AI_thinking:
-                            chess_AI_process.terminate()
+                            engine.cancelSearch()
                             AI_thinking = False
                         move_undone = True
                     if e.key == pygame.K_r: # reset the board when 'r' is pressed
-                        gs = GameState()
+                        gs = newGameState()
+                        if engine is not None:
+                            engine.reset()
                         valid_moves = gs.getValidMoves()
                         sq_selected = ()
                         player_clicks = []
                         move_made = False
                         animate = False
+                        animation = None
                         game_over = False
+                        AI_info = None
+                        AI_stats = None
                         if AI_thinking:
-                            chess_AI_process.terminate()
+                            engine.cancelSearch()
                             AI_thinking = False
                         move_undone = True
+                    if e.key == pygame.K_s and engine is not None:
+                        show_stats = not show_stats
+                        engine.collectStats(show_stats)
+                        if not show_stats:
+                            AI_stats = None
+                    if e.key == pygame.K_p:
+                        profiler.toggle()
+                        last_frame = None  # the overlay covers the move log
 
             # AI move
             if not game_over and not human_turn and not move_undone:
                 if not AI_thinking:
                     AI_thinking = True
-                    return_queue = Queue() #used to pass data between threads
-                    chess_AI_process = Process(target=ChessAI.findBestMove, args=(gs, valid_moves, return_queue))
-                    chess_AI_process.start() # call findBestMove(gs, valid_moves, return Queue)
-                if not chess_AI_process.is_alive():
-                    AI_move = return_queue.get()
+                    search_done = False
+                    engine.startSearch()
+                if search_done:
+                    AI_move = None
+                    for move in valid_moves:
+                        if move.move_ID == AI_move_ID:
+                            AI_move = move
                     if AI_move is None:
                         AI_move = ChessAI.fineRandomMove(valid_moves)
                     gs.makeMove(AI_move)
+                    engine.makeMove(AI_move)
                     move_made = True
                     animate = True 
                     AI_thinking = False         
 
             if move_made:
                 if animate:
-                    animateMove(gs.moveLog[-1], screen, gs.board, clock)
+                    # a move made while another is still sliding cuts that animation short
                     move = gs.moveLog[-1]
-                    playSound(True) if move.is_capture else playSound(False)
+                    animation = (move, time.perf_counter())
+                    playSound(move.is_capture)
+                else:
+                    animation = None
                 valid_moves = gs.getValidMoves()
                 move_made = False
                 animate = False
                 move_undone = False
 
-            drawGameState(screen, gs, valid_moves, sq_selected, move_log_font, motion)
-
+            end_text = None
             if gs.check_mate or gs.stale_mate:
                 game_over = True
                 if gs.stale_mate:
-                    text = "Stalemate"
+                    end_text = "Stalemate"
+                else:
+                    end_text = "Black wins by checkmate" if gs.white_to_move else "White wins by checkmate"
+
+            # the animation runs for a fixed time however many frames it gets
+            sliding = None
+            if animation is not None:
+                progress = (time.perf_counter() - animation[1]) / ANIMATION_SECONDS
+                if progress < 1:
+                    sliding = (animation[0], progress)
                 else:
-                    text = "Black wins by checkmate" if gs.white_to_move else "White wins by checkmate"
-                
-                drawEndGameText(screen, text)
+                    animation = None
+
+            # redraw and update only what changed since the last frame
+            profiler.mark("events")
+            AI_lines = ([AI_info] if AI_info is not None else []) + (AI_stats or [])
+            frame = frameState(gs, valid_moves, sq_selected, motion, end_text, sliding, AI_lines)
+            profiler.mark("frame_state")
+            dirty_rects = drawChanges(screen, gs, frame, last_frame, move_log_font)
+            if profiler.enabled:
+                panel_rect = pygame.Rect(WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
+                profiler.draw(screen, panel_rect, getFont("profiler"))
+                dirty_rects.append(panel_rect)
+                profiler.mark("overlay")
+            if dirty_rects:
+                pygame.display.update(dirty_rects)
+            profiler.mark("update")
+            profiler.endFrame()
+            last_frame = frame
+
+            # only an animation needs the loop to keep running, at a limited rate
+            if animation is not None:
+                clock.tick(ANIMATION_FPS)
+
+        if engine is not None:
+            engine.quit()
+        if profiler.enabled:
+            profiler.close()
+
+# Everything the screen shows, compared between frames to find what has to be redrawn.
+# sliding is (move, progress) while a move is animated: its piece is drawn on the way and
+# whatever it captures stays on the board until it arrives.
+def frameState(gs, valid_moves, sq_selected, motion, end_text, sliding=None, AI_lines=()):
+    board = [row[:] for row in gs.board]
+    sprite = None
+    if sliding is not None:
+        move, progress = sliding
+        board[move.end_row][move.end_col] = "-"
+        if move.piece_captured != "-":
+            captured_row = move.end_row
+            if move.is_enpassant_move:
+                captured_row = move.end_row+1 if move.piece_captured[0] == 'b' else move.end_row-1
+            board[captured_row][move.end_col] = move.piece_captured
+        sprite = (move.piece_moved,
+                  move.start_row + (move.end_row - move.start_row) * progress,
+                  move.start_col + (move.end_col - move.start_col) * progress)
+    return {
+        "board": board,
+        "highlights": highlightedSquares(gs, valid_moves, sq_selected),
+        "hover": motion,
+        "moves": [move.move_ID for move in gs.moveLog],
+        "end_text": end_text,
+        "sprite": sprite,
+        "AI_lines": tuple(AI_lines),
+    }
+
+# The squares a moving piece overlaps
+def spriteSquares(sprite):
+    if sprite is None:
+        return set()
+    piece, row, col = sprite
+    return {(r, c) for r in {math.floor(row), math.ceil(row)} for c in {math.floor(col), math.ceil(col)}}
+
+# Redraw the squares and panel that differ from the last frame, returns the rects to update.
+# Without a last frame everything is drawn.
+def drawChanges(screen, gs, frame, last_frame, move_log_font):
+    if last_frame is None:
+        last_frame = {"board": [[None] * DIMENSIONS for row in range(DIMENSIONS)], "highlights": {}, "hover": (),
+                      "moves": None, "end_text": None, "sprite": None, "AI_lines": None}
+    dirty_squares = spriteSquares(frame["sprite"]) | spriteSquares(last_frame["sprite"])
+    for row in range(DIMENSIONS):
+        for col in range(DIMENSIONS):
+            if frame["board"][row][col] != last_frame["board"][row][col]:
+                dirty_squares.add((row, col))
+    for square in set(frame["highlights"]) | set(last_frame["highlights"]):
+        if frame["highlights"].get(square) != last_frame["highlights"].get(square):
+            dirty_squares.add(square)
+    if frame["hover"] != last_frame["hover"]:
+        for square in (frame["hover"], last_frame["hover"]):
+            if square:
+                dirty_squares.add(square)
+    # the end of game text lies across several squares, so the whole board goes with it
+    if frame["end_text"] != last_frame["end_text"] or (frame["end_text"] is not None and dirty_squares):
+        dirty_squares = {(row, col) for row in range(DIMENSIONS) for col in range(DIMENSIONS)}
+    profiler.mark("diff")
 
-            clock.tick(MAX_FPS)
-            pygame.display.update()
+    dirty_rects = []
+    for row, col in dirty_squares:
+        drawSquare(screen, frame, row, col)
+    profiler.mark("squares")
+    if dirty_squares:
+        if frame["sprite"] is not None:
+            drawPiece(screen, *frame["sprite"])
+        profiler.mark("sprite")
+        if frame["end_text"] is not None:
+            drawEndGameText(screen, frame["end_text"])
+        profiler.mark("end_text")
+        if len(dirty_squares) == DIMENSIONS * DIMENSIONS:
+            dirty_rects.append(pygame.Rect(0, 0, WIDTH, HEIGHT))
+        else:
+            dirty_rects.extend(pygame.Rect(col * SQSIZE, row * SQSIZE, SQSIZE, SQSIZE) for row, col in dirty_squares)
 
-def drawGameState(screen, gs, valid_moves, sq_selected, move_log_font, motion=()):
-    drawBoard(screen) # draw squares on board
-    highlightSquares(screen, gs, valid_moves, sq_selected)
-    drawPieces(screen, gs.board) # draw pieces on top of squares
-    showHover(screen, motion)
-    drawMoveLog(screen, gs, move_log_font)
-    drawMovesText(screen, "MOVES")
+    if frame["moves"] != last_frame["moves"] or frame["AI_lines"] != last_frame["AI_lines"]:
+        drawMoveLog(screen, gs, move_log_font)
+        drawMovesText(screen, "MOVES")
+        drawAILines(screen, frame["AI_lines"], move_log_font)
+        dirty_rects.append(pygame.Rect(WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT))
+    profiler.mark("move_log")
+    return dirty_rects
+
+# One square with its highlight, piece and hover outline
+def drawSquare(screen, frame, row, col):
+    rect = pygame.Rect(col * SQSIZE, row * SQSIZE, SQSIZE, SQSIZE)
+    screen.blit(getBoardSurface(SQSIZE), rect, area=rect)
+    for color in frame["highlights"].get((row, col), ()):
+        screen.blit(getHighlightSurface(color), rect)
+    piece = frame["board"][row][col]
+    if piece != "-":
+        drawPiece(screen, piece, row, col)
+    if frame["hover"] == (row, col):
+        showHover(screen, frame["hover"])
 
 def showHover(screen, motion):
     if motion:
@@ -170,72 +370,68 @@ def showHover(screen, motion):
         # blit
         pygame.draw.rect(screen, color, rect, width=3)
 
-# draw squares on board
-def drawBoard(screen):
-    global colors
-    colors = [pygame.Color(234, 235, 200), pygame.Color(119, 154, 88)]
+# The squares and their coordinates, rendered once per square size
+def getBoardSurface(square_size):
+    if square_size in board_surfaces:
+        return board_surfaces[square_size]
+    surface = pygame.Surface((square_size * DIMENSIONS, square_size * DIMENSIONS))
+    font = getFont("coordinates")
     for row in range(DIMENSIONS):
         for col in range(DIMENSIONS):
             color = colors[((row + col) % 2)]
-            pygame.draw.rect(screen, color, pygame.Rect(col * SQSIZE, row * SQSIZE, SQSIZE, SQSIZE))
+            pygame.draw.rect(surface, color, pygame.Rect(col * square_size, row * square_size, square_size, square_size))
 
-            font = pygame.font.SysFont('monospace', 18, bold=True)
-            
-            # row coordinates
+            # row coordinates, in the color of the other squares
             if col == 0:
-                # color
-                color = pygame.Color(119, 154, 88) if row % 2 == 0 else pygame.Color(234, 235, 200)
-                # label
-                lbl = font.render(str(DIMENSIONS-row), 1, color)
-                lbl_pos = (5, 5 + row * SQSIZE)
-                # blit
-                screen.blit(lbl, lbl_pos)
+                lbl = font.render(str(DIMENSIONS-row), 1, colors[(row + 1) % 2])
+                surface.blit(lbl, (5, 5 + row * square_size))
 
             # col coordinates
             if row == 7:
-                # color
-                color = pygame.Color(119, 154, 88) if (row + col) % 2 == 0 else pygame.Color(234, 235, 200)
-                # label
-                lbl = font.render(ALPHACOLS[col], 1, color)
-                lbl_pos = (col * SQSIZE + SQSIZE - 15, HEIGHT - 20)
-                # blit
-                screen.blit(lbl, lbl_pos)
-
-# Hightlight square selected and moves for piece selected
-def highlightSquares(screen, gs, valid_moves, sq_selected):
+                lbl = font.render(ALPHACOLS[col], 1, colors[(row + col + 1) % 2])
+                surface.blit(lbl, (col * square_size + square_size - 15, square_size * DIMENSIONS - 20))
+    board_surfaces[square_size] = surface.convert()
+    return board_surfaces[square_size]
+
+# A piece image scaled to fit a square, scaled once per square size
+def getPieceSprite(piece, square_size):
+    key = (piece, square_size)
+    if key not in piece_sprites:
+        size = int(square_size * PIECE_SCALE)
+        piece_sprites[key] = pygame.transform.scale(IMAGES[piece], (size, size)).convert_alpha()
+    return piece_sprites[key]
+
+def getHighlightSurface(color):
+    if color not in highlight_surfaces:
+        s = pygame.Surface((SQSIZE, SQSIZE))
+        s.set_alpha(100) # transperancy value -> 0 transparent; 255 opaque
+        s.fill(pygame.Color(color))
+        highlight_surfaces[color] = s
+    return highlight_surfaces[color]
+
+# The highlight colors of every highlighted square, drawn in order on top of each other
+def highlightedSquares(gs, valid_moves, sq_selected):
+    highlights = {}
     if sq_selected != ():
         row, col = sq_selected
         if gs.board[row][col][0] == ("w" if gs.white_to_move else "b"):
             # highlight selected square
-            s = pygame.Surface((SQSIZE, SQSIZE))
-            s.set_alpha(100) # transperancy value -> 0 transparent; 255 opaque
-            s.fill(pygame.Color('blue'))
-            screen.blit(s, (col*SQSIZE, row*SQSIZE))
+            highlights[(row, col)] = ('blue',)
 
-            # hightlight moves from selected square
-            s.fill(pygame.Color('yellow'))
-            for move in valid_moves:
-                if move.start_row == row and move.start_col == col:
-                    screen.blit(s, (move.end_col*SQSIZE, move.end_row*SQSIZE))
-            
-            s.fill(pygame.Color(255, 0, 0))
+            # hightlight moves from selected square, captures in red on top of the yellow
             for move in valid_moves:
                 if move.start_row == row and move.start_col == col:
                     if gs.board[move.end_row][move.end_col][0] == ("b" if gs.white_to_move else "w"):
-                        screen.blit(s, (move.end_col*SQSIZE, move.end_row*SQSIZE))
+                        highlights[(move.end_row, move.end_col)] = ('yellow', 'red')
+                    else:
+                        highlights[(move.end_row, move.end_col)] = ('yellow',)
+    return highlights
 
-# draw pieces on squares
-def drawPieces(screen, board):
-    
-    for row in range(DIMENSIONS):
-        for col in range(DIMENSIONS):
-            piece = board[row][col]
-
-            if piece != "-": # not empty piece
-                img = pygame.transform.scale(IMAGES[piece], (SQSIZE * .76, SQSIZE * .76))
-                img_center = col * SQSIZE + SQSIZE // 2, row * SQSIZE + SQSIZE // 2
-                texture_rect = img.get_rect(center=img_center)
-                screen.blit(img, texture_rect)
+# draw one piece centered on a square, row and col may be fractions while animating
+def drawPiece(screen, piece, row, col):
+    img = getPieceSprite(piece, SQSIZE)
+    img_center = col * SQSIZE + SQSIZE // 2, row * SQSIZE + SQSIZE // 2
+    screen.blit(img, img.get_rect(center=img_center))
 
 # draws move log
 def drawMoveLog(screen , gs, font):
@@ -263,35 +459,43 @@ def drawMoveLog(screen , gs, font):
         screen.blit(text_object, text_location)
         textY += text_object.get_height() + line_spacing
 
-# Animation a move
-def animateMove(move, screen, board, clock):
-    global colors
-    co_ords = []
-    dR = move.end_row - move.start_row
-    dC = move.end_col - move.start_col
-    frames_per_second = 8
-    frame_count = (abs(dR) + abs(dC)) * frames_per_second
-    for frame in range(frame_count + 1):
-        row, col = (move.start_row + dR*frame/frame_count, move.start_col + dC*frame/frame_count)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        # erase the piece moved from its ending square
-        color = colors[(move.end_row + move.end_col) % 2]
-        end_square = pygame.Rect(move.end_col*SQSIZE, move.end_row*SQSIZE, SQSIZE, SQSIZE)
-        pygame.draw.rect(screen, color, end_square)
-        # draw captured piece onto rectangle
-        if move.piece_captured != "-":
-            if move.is_enpassant_move:
-                en_passant_row = move.end_row+1 if move.piece_captured[0] == 'b' else move.end_row-1
-                end_square = pygame.Rect(move.end_col * SQSIZE, en_passant_row * SQSIZE, SQSIZE, SQSIZE)
-            screen.blit(IMAGES[move.piece_captured], end_square)
-        # draw moving pieces
-        screen.blit(IMAGES[move.piece_moved], pygame.Rect(col*SQSIZE, row*SQSIZE, SQSIZE, SQSIZE))
-        pygame.display.flip()
-        clock.tick(60)
+# The AI's progress: depth reached, the move it would play and the score for white in pawns
+def infoText(depth, score, move_ID, valid_moves, white_to_move):
+    move_text = "-"
+    for move in valid_moves:
+        if move.move_ID == move_ID:
+            move_text = str(move)
+    if not white_to_move:
+        score = -score
+    if abs(score) >= ChessAI.CHECKMATE:
+        score_text = "white mates" if score > 0 else "black mates"
+    else:
+        score_text = "%+.2f" % score
+    return "AI depth %d: %s (%s)" % (depth, move_text, score_text)
+
+# Summary of a search's statistics from ChessAI, a few short lines for the move log panel
+def statsText(stats):
+    if "iterations" not in stats:
+        # a parallel search only reports its own timing
+        return ["%d workers, %.0f%% busy" % (stats["workers"], stats["efficiency"] * 100)]
+    lines = ["nodes %d  %.0f n/s" % (stats["nodes"], stats["nps"] or 0)]
+    if stats["cutoffs"]:
+        lines.append("cutoffs %d, %.0f%% on 1st move" % (stats["cutoffs"], stats["first_move_cutoff_rate"] * 100))
+    if stats["seconds"] > 0:
+        # share of the search time spent generating moves, making them and scoring boards
+        shares = [(label, stats["times"][name] / stats["seconds"] * 100)
+                  for label, name in (("gen", "getValidMoves"), ("make", "makeMove"), ("eval", "scoreBoard"))]
+        lines.append("  ".join("%s %.0f%%" % share for share in shares))
+    return lines
+
+# draws the AI's progress and statistics at the bottom of the move log panel, last line at the bottom
+def drawAILines(screen, lines, font):
+    for i, text in enumerate(reversed(lines)):
+        text_object = font.render(text, True, pygame.Color('gray'))
+        screen.blit(text_object, (WIDTH + 5, MOVE_LOG_PANEL_HEIGHT - (i + 1) * AI_INFO_LINE_HEIGHT))
 
 def drawEndGameText(screen, text): 
-    font = pygame.font.SysFont("Helvitca", 32, True, False)
+    font = getFont("title")
     text_object = font.render(text, 0, pygame.Color('Gray'))
     text_location = pygame.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - text_object.get_width()/2, HEIGHT/2 - text_object.get_height()/2)
     screen.blit(text_object, text_location)
@@ -299,7 +503,7 @@ def drawEndGameText(screen, text):
     screen.blit(text_object, text_location.move(2, 2))
 
 def drawMovesText(screen, text): 
-    font = pygame.font.SysFont("Helvitca", 32, True, False)
+    font = getFont("title")
     text_object = font.render(text, 0, pygame.Color('Gray'))
     text_location = pygame.Rect(WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT).move(MOVE_LOG_PANEL_WIDTH/2 - text_object.get_width()/2, 5)
     screen.blit(text_object, text_location)
@@ -0,0 +1,352 @@
+import argparse
+import json
+import math
+import os
+import random
+import time
+from multiprocessing import Pool
+import ChessAI
+import ChessBitbase
+import ChessBitboard
+from ChessBitboard import newGameState
+from ChessPerft import START_FEN
+
+'''
+Headless self-play between two configurations of ChessAI, to measure what a change to the search or the
+evaluation is worth. Games run in parallel in a process pool, every opening is played twice with the colors
+swapped, and the match reports the Elo difference of the first engine and can stop early on an SPRT result.
+
+An engine is a set of ChessAI settings, e.g. --first MAX_DEPTH=3 --second MAX_DEPTH=4 USE_BOOK=false.
+The openings file has one position per line, either a FEN/EPD or coordinate moves from the start ("e2e4 e7e5").
+'''
+
+# decisive and drawn games are ended early once both engines agree on the score for this many plies
+RESIGN_SCORE = 6.0  # pawns
+RESIGN_PLIES = 6
+DRAW_SCORE = 0.1
+DRAW_PLIES = 12
+DRAW_AFTER_PLY = 80  # score-based draws only after this many plies
+MAX_PLIES = 400
+
+# Settings of a game, parsed from NAME=VALUE arguments, values are JSON where they parse as JSON
+def parseEngineOptions(arguments):
+    options = {}
+    for argument in arguments:
+        name, _, value = argument.partition("=")
+        if not name.isupper() or not hasattr(ChessAI, name):
+            raise ValueError("unknown ChessAI setting " + name)
+        try:
+            options[name] = json.loads(value)
+        except ValueError:
+            options[name] = value
+    # killer_moves and the per ply stats are sized for the MAX_DEPTH ChessAI was imported with
+    if "MAX_DEPTH" in options:
+        if type(options["MAX_DEPTH"]) is not int or options["MAX_DEPTH"] < 1:
+            raise ValueError("MAX_DEPTH must be a positive whole number")
+        options["MAX_DEPTH"] = min(options["MAX_DEPTH"], ChessAI.MAX_DEPTH)
+    return options
+
+# (fen, coordinate moves) for one line of the openings file
+def parseOpening(line):
+    if "/" in line:
+        fields = line.split()
+        # an EPD line has no move counters, its opcodes follow the 4 position fields
+        counters = fields[4:6] if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit() else ["0", "1"]
+        return " ".join(fields[:4] + counters), []
+    return START_FEN, line.split()
+
+def readOpenings(path):
+    if path is None:
+        return [(START_FEN, [])]
+    openings = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                openings.append(parseOpening(line))
+    return openings
+
+# Standard algebraic notation of a move, without the check suffix which needs the position after it
+def sanNotation(move, valid_moves):
+    san = str(move)
+    if move.piece_moved[1] in ("p", "K") or move.is_castle_move:
+        return san
+    # another piece of the same kind that can reach the square has to be told apart by file, rank or both
+    others = [other for other in valid_moves if other.piece_moved == move.piece_moved and other.move_ID != move.move_ID
+              and other.end_row == move.end_row and other.end_col == move.end_col]
+    if not others:
+        return san
+    file = move.cols_to_files[move.start_col]
+    rank = move.rows_to_ranks[move.start_row]
+    if all(other.start_col != move.start_col for other in others):
+        disambiguation = file
+    elif all(other.start_row != move.start_row for other in others):
+        disambiguation = rank
+    else:
+        disambiguation = file + rank
+    return san[0] + disambiguation + san[1:]
+
+# transposition tables of the two engines in this pool process, each engine keeps its own
+engine_tables = {}
+default_settings = {}
+
+# Set ChessAI up as one of the engines, every setting either engine changes is put back to its default first
+def applyEngine(engine_index, engines, hash_mb):
+    for engine in engines:
+        for name in engine["options"]:
+            default_settings.setdefault(name, getattr(ChessAI, name))
+    for name, value in default_settings.items():
+        setattr(ChessAI, name, engines[engine_index]["options"].get(name, value))
+    if engine_index not in engine_tables:
+        engine_tables[engine_index] = ChessAI.TranspositionTable(hash_mb)
+    ChessAI.transposition_table = engine_tables[engine_index]
+
+# Process target: play one game, the first engine has white unless swapped.
+# Returns the game as a dict, with the result from white's side.
+def playGame(task):
+    game_index, opening, swapped, engines, limits = task
+    random.seed(limits["seed"] + game_index)
+    ChessBitboard.USE_BITBOARDS = limits["bitboards"]
+    white, black = (1, 0) if swapped else (0, 1)
+    fen, opening_moves = opening
+    for table in engine_tables.values():
+        table.clear()
+
+    gs = newGameState()
+    gs.loadFen(fen)
+    fields = fen.split()
+    halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+    # positions since the last capture or pawn move, for repetitions
+    position_keys = [gs.zobrist_key]
+    white_scores = []  # every searched ply's score from white's side, None for book moves
+    moves = []
+    result = termination = None
+
+    node_limit = limits["nodes"]
+    ChessAI.interrupt_check = lambda: node_limit is not None and ChessAI.nodes_searched >= node_limit
+    last_score = [None]
+    ChessAI.iteration_callback = lambda depth, score, nodes, move: last_score.__setitem__(0, score)
+
+    valid_moves = gs.getValidMoves()
+    while result is None:
+        ply = len(moves)
+        if ply < len(opening_moves):
+            move = next((move for move in valid_moves if move.getChessNotation() == opening_moves[ply]), None)
+            if move is None:
+                raise ValueError("illegal opening move %s in %s" % (opening_moves[ply], " ".join(opening_moves)))
+            white_scores.append(None)
+        else:
+            engine_index = white if gs.white_to_move else black
+            applyEngine(engine_index, engines, limits["hash"])
+            last_score[0] = None
+            time_limit = limits["time"] if limits["time"] is not None else ChessAI.TIME_LIMIT
+            move = ChessAI.searchBestMove(gs, list(valid_moves), time_limit, ChessAI.MAX_DEPTH, 1)
+            if move is None:
+                move = valid_moves[0]  # the node limit ran out inside the first iteration
+            score = last_score[0]
+            white_scores.append(None if score is None else score if gs.white_to_move else -score)
+
+        san = sanNotation(move, valid_moves)
+        gs.makeMove(move)
+        valid_moves = gs.getValidMoves()
+        if gs.in_check:
+            san += "#" if gs.check_mate else "+"
+        moves.append(san)
+
+        if move.is_capture or move.piece_moved[1] == "p":
+            halfmove_clock = 0
+            position_keys = []
+        else:
+            halfmove_clock += 1
+        position_keys.append(gs.zobrist_key)
+
+        if gs.check_mate:
+            result, termination = ("0-1" if gs.white_to_move else "1-0"), "checkmate"
+        elif gs.stale_mate:
+            result, termination = "1/2-1/2", "stalemate"
+        elif position_keys.count(gs.zobrist_key) >= 3:
+            result, termination = "1/2-1/2", "threefold repetition"
+        elif halfmove_clock >= 100:
+            result, termination = "1/2-1/2", "fifty move rule"
+        else:
+            result, termination = adjudicate(gs, white_scores, limits)
+
+    return {
+        "index": game_index,
+        "white": engines[white]["name"],
+        "black": engines[black]["name"],
+        "first_is_white": not swapped,
+        "fen": fen,
+        "moves": moves,
+        "result": result,
+        "termination": termination,
+    }
+
+# (result, reason) when the game can be ended before the rules end it, (None, None) otherwise
+def adjudicate(gs, white_scores, limits):
+    if gs.piece_count <= 3:
+        bitbase_result = ChessBitbase.probeBitbase(gs)
+        if bitbase_result is not None:
+            return ("1-0", "1/2-1/2", "0-1")[1 - bitbase_result], "bitbase"
+    if len(white_scores) >= limits["max_plies"]:
+        return "1/2-1/2", "maximum game length"
+    last_scores = white_scores[-limits["resign_plies"]:]
+    if limits["resign_plies"] and len(last_scores) == limits["resign_plies"] and None not in last_scores:
+        if all(score >= limits["resign_score"] for score in last_scores):
+            return "1-0", "adjudicated win"
+        if all(score <= -limits["resign_score"] for score in last_scores):
+            return "0-1", "adjudicated win"
+    last_scores = white_scores[-limits["draw_plies"]:]
+    if (limits["draw_plies"] and len(white_scores) >= limits["draw_after"] and len(last_scores) == limits["draw_plies"]
+            and None not in last_scores and all(abs(score) <= limits["draw_score"] for score in last_scores)):
+        return "1/2-1/2", "adjudicated draw"
+    return None, None
+
+def pgnGame(game, event):
+    headers = [
+        ("Event", event),
+        ("Site", "?"),
+        ("Date", time.strftime("%Y.%m.%d")),
+        ("Round", str(game["index"] + 1)),
+        ("White", game["white"]),
+        ("Black", game["black"]),
+        ("Result", game["result"]),
+    ]
+    if game["fen"] != START_FEN:
+        headers += [("SetUp", "1"), ("FEN", game["fen"])]
+    headers += [("PlyCount", str(len(game["moves"]))), ("Termination", game["termination"])]
+
+    fields = game["fen"].split()
+    move_number = int(fields[5])
+    white_to_move = fields[1] == "w"
+    tokens = []
+    for i, san in enumerate(game["moves"]):
+        if white_to_move:
+            tokens.append("%d." % move_number)
+        elif i == 0:
+            tokens.append("%d..." % move_number)
+        tokens.append(san)
+        if not white_to_move:
+            move_number += 1
+        white_to_move = not white_to_move
+    tokens.append(game["result"])
+
+    # move text wrapped at 80 characters
+    lines = [""]
+    for token in tokens:
+        if lines[-1] and len(lines[-1]) + 1 + len(token) > 80:
+            lines.append("")
+        lines[-1] += (" " if lines[-1] else "") + token
+    return "".join('[%s "%s"]\n' % header for header in headers) + "\n" + "\n".join(lines) + "\n\n"
+
+def eloToScore(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+def scoreToElo(score):
+    # the ends of a confidence interval can pass 0 or 1
+    score = min(max(score, 1e-9), 1 - 1e-9)
+    return -400 * math.log10(1 / score - 1)
+
+# Mean score and the variance of a single game's score
+def scoreStats(wins, draws, losses):
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    return score, variance
+
+# Elo difference and the half width of its 95% confidence interval
+def eloEstimate(wins, draws, losses):
+    games = wins + draws + losses
+    score, variance = scoreStats(wins, draws, losses)
+    if score in (0, 1):
+        return math.copysign(math.inf, score - 0.5), math.inf
+    margin = 1.96 * math.sqrt(variance / games)
+    return scoreToElo(score), (scoreToElo(score + margin) - scoreToElo(score - margin)) / 2
+
+# Log-likelihood ratio of elo1 against elo0, with the normal approximation of the game scores
+def sprtLLR(wins, draws, losses, elo0, elo1):
+    games = wins + draws + losses
+    score, variance = scoreStats(wins, draws, losses)
+    if variance == 0:
+        return 0
+    score0 = eloToScore(elo0)
+    score1 = eloToScore(elo1)
+    return games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+
+def sprtBounds(alpha, beta):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+def main():
+    parser = argparse.ArgumentParser(description="Play two ChessAI configurations against each other")
+    parser.add_argument("--first", nargs="*", default=[], metavar="NAME=VALUE", help="ChessAI settings of the first engine")
+    parser.add_argument("--second", nargs="*", default=[], metavar="NAME=VALUE", help="ChessAI settings of the second engine")
+    parser.add_argument("--names", nargs=2, default=["first", "second"], help="engine names for the PGN")
+    parser.add_argument("--games", type=int, default=100, help="games to play, rounded up to a pair per opening")
+    parser.add_argument("--openings", default=None, help="file of FENs or coordinate move lines, each played with both colors")
+    parser.add_argument("--time", type=float, default=None, help="seconds per move, defaults to each engine's TIME_LIMIT")
+    parser.add_argument("--nodes", type=int, default=None, help="nodes per move")
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count(), help="games played at once")
+    parser.add_argument("--hash", type=int, default=16, help="transposition table megabytes per engine and process")
+    parser.add_argument("--bitboards", action="store_true", help="play with the bitboard move generator")
+    parser.add_argument("--max-plies", type=int, default=MAX_PLIES)
+    parser.add_argument("--resign-score", type=float, default=RESIGN_SCORE)
+    parser.add_argument("--resign-plies", type=int, default=RESIGN_PLIES, help="0 turns win adjudication off")
+    parser.add_argument("--draw-score", type=float, default=DRAW_SCORE)
+    parser.add_argument("--draw-plies", type=int, default=DRAW_PLIES, help="0 turns draw adjudication off")
+    parser.add_argument("--draw-after", type=int, default=DRAW_AFTER_PLY)
+    parser.add_argument("--sprt", nargs=4, type=float, default=None, metavar=("ELO0", "ELO1", "ALPHA", "BETA"),
+                        help="stop once the first engine is shown to be ELO0 or ELO1 stronger")
+    parser.add_argument("--pgn", default=None, help="append the games to this PGN file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        engines = [{"name": args.names[0], "options": parseEngineOptions(args.first)},
+                   {"name": args.names[1], "options": parseEngineOptions(args.second)}]
+    except ValueError as error:
+        parser.error(str(error))
+    limits = {"time": args.time, "nodes": args.nodes, "hash": args.hash, "bitboards": args.bitboards, "seed": args.seed,
+              "max_plies": args.max_plies, "resign_score": args.resign_score, "resign_plies": args.resign_plies,
+              "draw_score": args.draw_score, "draw_plies": args.draw_plies, "draw_after": args.draw_after}
+    openings = readOpenings(args.openings)
+    # game pairs go through the openings in order, the second game of a pair swaps the colors
+    tasks = [(i, openings[i // 2 % len(openings)], i % 2 == 1, engines, limits) for i in range(args.games + args.games % 2)]
+    if args.sprt is not None:
+        bounds = sprtBounds(args.sprt[2], args.sprt[3])
+    event = "%s vs %s" % (args.names[0], args.names[1])
+
+    # results from the first engine's side
+    wins = draws = losses = 0
+    start = time.perf_counter()
+    pool = Pool(args.concurrency)
+    try:
+        for game in pool.imap_unordered(playGame, tasks):
+            if game["result"] == "1/2-1/2":
+                draws += 1
+            elif (game["result"] == "1-0") == game["first_is_white"]:
+                wins += 1
+            else:
+                losses += 1
+            if args.pgn is not None:
+                with open(args.pgn, "a") as f:
+                    f.write(pgnGame(game, event))
+
+            elo, margin = eloEstimate(wins, draws, losses)
+            line = "games %d: +%d -%d =%d  elo %+.1f +/- %.1f" % (wins + draws + losses, wins, losses, draws, elo, margin)
+            if args.sprt is not None:
+                llr = sprtLLR(wins, draws, losses, args.sprt[0], args.sprt[1])
+                line += "  LLR %.2f (%.2f, %.2f)" % (llr, bounds[0], bounds[1])
+                if llr <= bounds[0] or llr >= bounds[1]:
+                    print(line)
+                    if llr >= bounds[1]:
+                        print("SPRT: H1 accepted, the first engine is %g elo stronger" % args.sprt[1])
+                    else:
+                        print("SPRT: H0 accepted, the first engine is %g elo stronger" % args.sprt[0])
+                    break
+            print(line)
+    finally:
+        pool.terminate()
+    print("%.1fs" % (time.perf_counter() - start))
+
+if __name__ == "__main__":
+    main()
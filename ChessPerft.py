@@ -0,0 +1,117 @@
+import argparse
+import json
+import time
+import ChessBitboard
+from ChessBitboard import newGameState
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# Standard test positions with their published leaf counts for depth 1, 2, 3...
+PERFT_POSITIONS = [
+    {"name": "start", "fen": START_FEN,
+     "nodes": [20, 400, 8902, 197281, 4865609]},
+    {"name": "kiwipete", "fen": "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     "nodes": [48, 2039, 97862, 4085603]},
+    {"name": "position3", "fen": "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     "nodes": [14, 191, 2812, 43238, 674624]},
+    {"name": "position4", "fen": "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     "nodes": [6, 264, 9467, 422333]},
+    {"name": "position5", "fen": "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     "nodes": [44, 1486, 62379, 2103487]},
+    {"name": "position6", "fen": "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     "nodes": [46, 2079, 89890, 3894594]},
+]
+
+# Count the leaf nodes of the legal move tree to the given depth
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMoves()
+    return nodes
+
+# Leaf counts broken down per root move, keyed by the move in coordinate notation
+def perftDivide(gs, depth):
+    counts = {}
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        counts[move.getChessNotation()] = perft(gs, depth - 1)
+        gs.undoMoves()
+    return counts
+
+def runPerft(fen, depth, divide=False, expected=None):
+    gs = newGameState()
+    gs.loadFen(fen)
+    start = time.perf_counter()
+    if divide:
+        counts = perftDivide(gs, depth)
+        nodes = sum(counts.values())
+    else:
+        counts = None
+        nodes = perft(gs, depth)
+    seconds = time.perf_counter() - start
+
+    result = {
+        "fen": fen,
+        "depth": depth,
+        "nodes": nodes,
+        "seconds": round(seconds, 4),
+        "nps": round(nodes / seconds) if seconds > 0 else 0,
+    }
+    if expected is not None:
+        result["expected"] = expected
+        result["passed"] = nodes == expected
+    if counts is not None:
+        result["divide"] = counts
+    return result
+
+# Run every standard position that has a known count at this depth
+def runSuite(depth, divide=False):
+    results = []
+    for position in PERFT_POSITIONS:
+        position_depth = min(depth, len(position["nodes"]))
+        result = runPerft(position["fen"], position_depth, divide, position["nodes"][position_depth - 1])
+        result["name"] = position["name"]
+        results.append(result)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Count and time move generation with perft")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fen", default=None, help="position to count, defaults to the standard suite")
+    parser.add_argument("--divide", action="store_true", help="break the count down per root move")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--bitboards", action="store_true", help="count with the bitboard move generator")
+    args = parser.parse_args()
+    ChessBitboard.USE_BITBOARDS = args.bitboards
+
+    if args.fen is not None:
+        results = [runPerft(args.fen, args.depth, args.divide)]
+    else:
+        results = runSuite(args.depth, args.divide)
+
+    for result in results:
+        status = ""
+        if "passed" in result:
+            status = "ok" if result["passed"] else "FAILED (expected %d)" % result["expected"]
+        print("%-10s depth %d: %10d nodes %8.2fs %8d nps %s" % (
+            result.get("name", "fen"), result["depth"], result["nodes"], result["seconds"], result["nps"], status))
+        for move, count in sorted(result.get("divide", {}).items()):
+            print("    %s: %d" % (move, count))
+
+    report = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if not all(result.get("passed", True) for result in results):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
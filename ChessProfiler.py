@@ -0,0 +1,127 @@
+import csv
+import time
+from collections import deque
+import pygame
+
+'''
+Frame-time profiler for ChessMain. The main loop marks the end of every step of a frame, the time since the
+previous mark is charged to that step, and the overlay shows the last frames of every step as a histogram.
+'''
+
+HISTORY = 240  # frames kept for the overlay
+# upper edges of the histogram buckets in milliseconds, the last bucket takes everything slower
+BUCKETS = (0.5, 1, 2, 4, 8, 16, 33, float("inf"))
+# the steps of a frame in loop order, "idle" is the time blocked waiting for events or the frame clock
+# and "AI_latency" the delay between the AI process posting a result and the loop handling it
+STEPS = ("idle", "events", "frame_state", "diff", "squares", "sprite", "end_text", "move_log", "overlay", "update")
+COLUMNS = STEPS + ("frame", "AI_latency")
+
+class FrameProfiler():
+
+    # with a csv_path every frame is kept while the profiler is on, and written out when it is turned off
+    def __init__(self, csv_path=None):
+        self.enabled = False
+        self.csv_path = csv_path
+        self.history = {column: deque(maxlen=HISTORY) for column in COLUMNS}
+        self.frame_ends = deque(maxlen=HISTORY)
+        self.rows = []
+        self.frame = {}
+        self.last_mark = time.perf_counter()
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        if not self.enabled:
+            self.close()
+        for column in COLUMNS:
+            self.history[column].clear()
+        self.frame_ends.clear()
+        self.frame = {}
+        self.last_mark = time.perf_counter()
+
+    # Charge the time since the last mark to a step
+    def mark(self, step):
+        if self.enabled:
+            now = time.perf_counter()
+            self.frame[step] = self.frame.get(step, 0) + now - self.last_mark
+            self.last_mark = now
+
+    # Timings that aren't a step of the loop, like a message's delay, the frame keeps the largest
+    def addSample(self, column, seconds):
+        if self.enabled:
+            self.frame[column] = max(self.frame.get(column, 0), seconds)
+
+    def endFrame(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.frame["frame"] = sum(self.frame.get(step, 0) for step in STEPS if step != "idle")
+        for column in COLUMNS:
+            if column in self.frame:
+                self.history[column].append(self.frame[column])
+        self.frame_ends.append(now)
+        if self.csv_path is not None:
+            self.rows.append((now, self.frame))
+        self.frame = {}
+        self.last_mark = now
+
+    # Frames drawn in the last second
+    def fps(self):
+        if not self.frame_ends:
+            return 0
+        now = time.perf_counter()
+        return sum(1 for end in self.frame_ends if now - end <= 1)
+
+    def histogram(self, column):
+        counts = [0] * len(BUCKETS)
+        for seconds in self.history[column]:
+            for i, edge in enumerate(BUCKETS):
+                if seconds * 1000 <= edge:
+                    counts[i] += 1
+                    break
+        return counts
+
+    # Write out the frames kept so far, when the profiler is turned off or the game ends
+    def close(self):
+        if self.csv_path is not None and self.rows:
+            self.writeCsv(self.csv_path)
+
+    # One row per frame, times in milliseconds, empty where a frame had no such timing
+    def writeCsv(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("time",) + COLUMNS)
+            start = self.rows[0][0] if self.rows else 0
+            for end, frame in self.rows:
+                writer.writerow(["%.4f" % (end - start)] + ["%.3f" % (frame[column] * 1000) if column in frame else ""
+                                                            for column in COLUMNS])
+        self.rows = []
+
+    # Draws over the move log panel: the frame rate, then mean and worst time of every step with its histogram
+    def draw(self, screen, rect, font):
+        pygame.draw.rect(screen, pygame.Color("black"), rect)
+        screen.blit(font.render("FPS %d   frames %d" % (self.fps(), len(self.frame_ends)), True,
+                                pygame.Color("white")), rect.move(5, 5))
+        line_height = font.get_height() + 6
+        bar_width = 8
+        bars_left = rect.right - len(BUCKETS) * (bar_width + 1) - 5
+        y = rect.top + 5 + line_height
+        for column in COLUMNS:
+            values = self.history[column]
+            texts = [column, "-", "-"]
+            if values:
+                texts[1:] = ["%.1f" % (sum(values) / len(values) * 1000), "%.1f" % (max(values) * 1000)]
+            # name left aligned, the two times right aligned in columns before the histogram
+            screen.blit(font.render(texts[0], True, pygame.Color("gray")), (rect.left + 5, y))
+            for i, text in enumerate(texts[1:]):
+                text_object = font.render(text, True, pygame.Color("gray"))
+                screen.blit(text_object, (bars_left - 45 * (1 - i) - 10 - text_object.get_width(), y))
+            counts = self.histogram(column)
+            most = max(counts) or 1
+            for i, count in enumerate(counts):
+                height = round(count / most * (line_height - 4))
+                if height:
+                    bar = pygame.Rect(bars_left + i * (bar_width + 1), y + line_height - 4 - height, bar_width, height)
+                    # buckets slower than a 60 FPS frame in red
+                    pygame.draw.rect(screen, pygame.Color("red" if BUCKETS[i] > 16 else "green"), bar)
+            y += line_height
+        screen.blit(font.render("ms: mean, worst, <0.5 ... >33", True, pygame.Color("gray")), (rect.left + 5, y))
@@ -0,0 +1,83 @@
+piece_score = {
+    "K":0, "Q":9, "R":5, "B":3, "N":3, "p":1
+}
+
+knight_scores = [[1, 1, 1, 1, 1, 1, 1, 1],
+                 [1, 2, 2, 2, 2, 2, 2, 1],
+                 [1, 2, 3, 3, 3, 3, 2, 1],
+                 [1, 2, 3, 4, 4, 3, 2, 1],
+                 [1, 2, 3, 4, 4, 3, 2, 1],
+                 [1, 2, 3, 3, 3, 3, 2, 1],
+                 [1, 2, 2, 2, 2, 2, 2, 1],
+                 [1, 1, 1, 1, 1, 1, 1, 1]]
+
+bishop_scores = [[4, 3, 2, 1, 1, 2, 3, 4],
+                 [3, 4, 3, 2, 2, 3, 4, 3],
+                 [2, 3, 4, 3, 3, 4, 3, 2],
+                 [1, 2, 3, 4, 4, 3, 2, 1],
+                 [1, 2, 3, 4, 4, 3, 2, 1],
+                 [2, 3, 4, 3, 3, 4, 3, 2],
+                 [3, 4, 3, 2, 2, 3, 4, 3],
+                 [4, 3, 2, 1, 1, 2, 3, 4]]
+
+queen_scores = [[1, 1, 1, 3, 1, 1, 1, 1],
+                 [1, 2, 3, 3, 3, 1, 1, 1],
+                 [1, 4, 3, 3, 3, 4, 2, 1],
+                 [1, 2, 3, 3, 3, 2, 2, 1],
+                 [1, 2, 3, 3, 3, 2, 2, 1],
+                 [1, 4, 3, 3, 3, 4, 2, 1],
+                 [1, 1, 2, 3, 3, 1, 1, 1],
+                 [1, 1, 1, 3, 1, 1, 1, 1]]
+
+rook_scores = [[4, 3, 4, 4, 4, 4, 3, 4],
+                 [4, 4, 4, 4, 4, 4, 4, 4],
+                 [1, 1, 2, 3, 3, 2, 1, 1],
+                 [1, 2, 3, 4, 4, 3, 2, 1],
+                 [1, 2, 3, 4, 4, 3, 2, 1],
+                 [1, 1, 2, 2, 2, 2, 1, 1],
+                 [4, 4, 4, 4, 4, 4, 4, 4],
+                 [4, 3, 4, 4, 4, 4, 3, 4]]
+
+white_pawn_scores = [[8, 8, 8, 8, 8, 8, 8, 8],
+                 [8, 8, 8, 8, 8, 8, 8, 8],
+                 [5, 6, 6, 7, 7, 6, 6, 5],
+                 [2, 3, 3, 5, 5, 3, 3, 2],
+                 [1, 2, 3, 4, 4, 3, 2, 1],
+                 [1, 1, 2, 3, 3, 2, 1, 1],
+                 [1, 1, 1, 0, 0, 1, 1, 1],
+                 [0, 0, 0, 0, 0, 0, 0, 0]]
+
+black_pawn_scores = [[0, 0, 0, 0, 0, 0, 0, 0],
+                 [1, 1, 1, 0, 0, 1, 1, 1],
+                 [1, 1, 2, 3, 3, 2, 1, 1],
+                 [1, 2, 3, 4, 4, 3, 2, 1],
+                 [2, 3, 3, 5, 5, 3, 3, 2],
+                 [5, 6, 6, 7, 7, 6, 6, 5],
+                 [8, 8, 8, 8, 8, 8, 8, 8],
+                 [8, 8, 8, 8, 8, 8, 8, 8]]
+
+
+piece_position_scores = {"N": knight_scores, "Q": queen_scores, "B": bishop_scores, "R": rook_scores, "bp": black_pawn_scores,
+                "wp": white_pawn_scores}
+
+
+# Combined material + positional value of every piece on every square, in tenths of a pawn.
+# White pieces count positive and black pieces negative so GameState can keep a running sum.
+def buildPieceSquareValues():
+    piece_square_values = {}
+    for piece in ("wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK"):
+        sign = 1 if piece[0] == "w" else -1
+        values = []
+        for row in range(8):
+            values.append([])
+            for col in range(8):
+                position_score = 0
+                if piece[1] == "p":
+                    position_score = piece_position_scores[piece][row][col]
+                elif piece[1] != "K":
+                    position_score = piece_position_scores[piece[1]][row][col]
+                values[row].append(sign * (piece_score[piece[1]] * 10 + position_score))
+        piece_square_values[piece] = values
+    return piece_square_values
+
+piece_square_values = buildPieceSquareValues()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+import os
+import sys
+import threading
+import time
+import ChessAI
+import ChessBitboard
+from ChessBitboard import newGameState
+
+'''
+Headless engine speaking the UCI protocol on stdin/stdout, so chess GUIs and tournament managers can
+play against the AI. It only needs GameState and ChessAI, pygame is never loaded.
+
+Supported: uci, isready, setoption, ucinewgame, position [startpos | fen ...] [moves ...],
+go [wtime btime winc binc movestogo movetime depth nodes infinite], stop, quit.
+'''
+
+ENGINE_NAME = "chess-game"
+ENGINE_AUTHOR = "VikyCham"
+
+# share of the remaining clock spent on one move when the GUI doesn't say how many moves are left
+MOVES_TO_GO = 30
+
+# the search thread and the command loop both write, one line at a time
+output_lock = threading.Lock()
+
+def send(line):
+    with output_lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+# The position a "position" command describes, None when one of its moves isn't legal
+def parsePosition(tokens):
+    gs = newGameState()
+    index = 1
+    if index < len(tokens) and tokens[index] == "fen":
+        fen_end = tokens.index("moves") if "moves" in tokens else len(tokens)
+        gs.loadFen(" ".join(tokens[index + 1:fen_end]))
+        index = fen_end
+    elif index < len(tokens) and tokens[index] == "startpos":
+        index += 1
+    if index < len(tokens) and tokens[index] == "moves":
+        for notation in tokens[index + 1:]:
+            moves = {move.getChessNotation(): move for move in gs.getValidMoves()}
+            if notation not in moves:
+                return None
+            gs.makeMove(moves[notation])
+    return gs
+
+# Seconds to think from the "go" parameters, None for no limit
+def moveTime(params, white_to_move):
+    if "movetime" in params:
+        return params["movetime"] / 1000
+    remaining = params.get("wtime" if white_to_move else "btime")
+    if remaining is None:
+        if "infinite" in params or "depth" in params or "nodes" in params:
+            return None
+        return ChessAI.TIME_LIMIT
+    increment = params.get("winc" if white_to_move else "binc", 0)
+    moves_to_go = params.get("movestogo", MOVES_TO_GO)
+    # keep a little for the GUI's own overhead, never plan past what is on the clock
+    budget = remaining / moves_to_go + increment * 3 / 4
+    return max(0.01, min(budget, remaining - 50) / 1000)
+
+def formatScore(score, depth):
+    if abs(score) >= ChessAI.CHECKMATE:
+        # the search doesn't track the mate distance, the iteration depth bounds it
+        moves = (depth + 1) // 2
+        return "mate %d" % (moves if score > 0 else -moves)
+    return "cp %d" % round(score * 100)
+
+
+class UCIEngine():
+
+    def __init__(self):
+        self.gs = newGameState()
+        self.workers = ChessAI.WORKERS
+        self.search_thread = None
+        self.stop_requested = threading.Event()
+        self.node_limit = None
+        self.search_start = 0
+        ChessAI.interrupt_check = self.shouldStop
+        ChessAI.iteration_callback = self.sendInfo
+        self.startWorkerPool()
+
+    # The pool's processes have to be forked here rather than from the search thread: while the command loop
+    # waits on stdin it holds the reader's lock, and a forked worker would block closing its copy of stdin
+    def startWorkerPool(self):
+        if self.workers > 1:
+            ChessAI.getWorkerPool(self.workers)
+
+    def shouldStop(self):
+        if self.stop_requested.is_set():
+            return True
+        return self.node_limit is not None and ChessAI.nodes_searched >= self.node_limit
+
+    def sendInfo(self, depth, score, nodes, move):
+        milliseconds = max(1, round((time.perf_counter() - self.search_start) * 1000))
+        line = "info depth %d score %s nodes %d time %d nps %d" % (
+            depth, formatScore(score, depth), nodes, milliseconds, nodes * 1000 // milliseconds)
+        if move is not None:
+            line += " pv " + move.getChessNotation()
+        send(line)
+
+    def run(self):
+        for line in sys.stdin:
+            tokens = line.split()
+            if not tokens:
+                continue
+            if not self.handleCommand(tokens):
+                break
+        self.stopSearch()
+
+    # Returns False once the engine should exit
+    def handleCommand(self, tokens):
+        command = tokens[0]
+        if command == "uci":
+            send("id name " + ENGINE_NAME)
+            send("id author " + ENGINE_AUTHOR)
+            send("option name Hash type spin default %d min 1 max 1024" % ChessAI.TT_SIZE_MB)
+            send("option name Threads type spin default %d min 1 max %d" % (ChessAI.WORKERS, os.cpu_count() or 1))
+            send("option name OwnBook type check default %s" % ("true" if ChessAI.USE_BOOK else "false"))
+            send("option name Bitbases type check default %s" % ("true" if ChessAI.USE_BITBASES else "false"))
+            send("option name Bitboards type check default %s" % ("true" if ChessBitboard.USE_BITBOARDS else "false"))
+            send("uciok")
+        elif command == "isready":
+            send("readyok")
+        elif command == "setoption":
+            self.stopSearch()
+            self.setOption(tokens)
+        elif command == "ucinewgame":
+            self.stopSearch()
+            ChessAI.transposition_table.clear()
+            self.gs = newGameState()
+        elif command == "position":
+            self.stopSearch()
+            gs = parsePosition(tokens)
+            if gs is None:
+                send("info string illegal move in position command")
+            else:
+                self.gs = gs
+        elif command == "go":
+            self.stopSearch()
+            self.startSearch(tokens)
+        elif command == "stop":
+            self.stopSearch()
+        elif command == "quit":
+            return False
+        return True
+
+    def setOption(self, tokens):
+        if "name" not in tokens:
+            return
+        value_index = tokens.index("value") if "value" in tokens else len(tokens)
+        name = " ".join(tokens[tokens.index("name") + 1:value_index]).lower()
+        value = " ".join(tokens[value_index + 1:])
+        if name == "hash":
+            ChessAI.transposition_table = ChessAI.TranspositionTable(max(1, int(value)))
+        elif name == "threads":
+            self.workers = max(1, int(value))
+            self.startWorkerPool()
+        elif name == "ownbook":
+            ChessAI.USE_BOOK = value.lower() == "true"
+        elif name == "bitbases":
+            ChessAI.USE_BITBASES = value.lower() == "true"
+        elif name == "bitboards":
+            ChessBitboard.USE_BITBOARDS = value.lower() == "true"
+        else:
+            send("info string unknown option " + name)
+
+    def startSearch(self, tokens):
+        params = {}
+        for i, token in enumerate(tokens):
+            if token in ("wtime", "btime", "winc", "binc", "movestogo", "movetime", "depth", "nodes") and i + 1 < len(tokens):
+                params[token] = int(tokens[i + 1])
+            elif token == "infinite":
+                params[token] = True
+        time_limit = moveTime(params, self.gs.white_to_move)
+        max_depth = min(params.get("depth", ChessAI.MAX_DEPTH), ChessAI.MAX_DEPTH)
+        self.node_limit = params.get("nodes")
+        self.stop_requested.clear()
+        self.search_start = time.perf_counter()
+        self.search_thread = threading.Thread(target=self.search, args=(
+            time_limit if time_limit is not None else float("inf"), max_depth, "infinite" in params), daemon=True)
+        self.search_thread.start()
+
+    def search(self, time_limit, max_depth, infinite):
+        valid_moves = self.gs.getValidMoves()
+        move = None
+        if len(valid_moves) != 0:
+            move = ChessAI.searchBestMove(self.gs, valid_moves, time_limit, max_depth, self.workers)
+            if move is None:
+                move = valid_moves[0]  # stopped before the first iteration finished
+        # an infinite search only answers once the GUI says stop, even when it ran out of things to search
+        if infinite:
+            self.stop_requested.wait()
+        send("bestmove " + (move.getChessNotation() if move is not None else "0000"))
+
+    def stopSearch(self):
+        if self.search_thread is not None:
+            self.stop_requested.set()
+            self.search_thread.join()
+            self.search_thread = None
+
+
+def main():
+    # the book and bitbases are found relative to the engine, whatever directory the GUI starts it from
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    UCIEngine().run()
+
+if __name__ == "__main__":
+    main()
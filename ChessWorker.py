@@ -0,0 +1,204 @@
+import threading
+import time
+from multiprocessing import Process, Queue
+import ChessAI
+from ChessBitboard import newGameState
+
+'''
+A long-lived AI process. It keeps its own copy of the game, updated with the moves played in the UI,
+so a search only needs a short command instead of the whole GameState, and the AI keeps its caches between moves.
+
+Commands sent to the worker:
+    ("move", move_ID), ("undo",), ("reset",), ("search", search_ID, time_limit), ("stats", on), ("quit",)
+Results sent back:
+    ("info", search_ID, depth, score, move_ID) after every finished iteration, score for the side to move
+    ("bestmove", search_ID, move_ID or None, search statistics or None)
+    ("stopped",) when the process exits
+'''
+
+# think on the human's time about the reply the AI expects, only with a single search process
+PONDER = True
+
+def engineLoop(command_queue, result_queue):
+    EngineProcess(command_queue, result_queue).run()
+
+# The state of the worker process
+class EngineProcess():
+
+    def __init__(self, command_queue, result_queue):
+        self.command_queue = command_queue
+        self.result_queue = result_queue
+        self.gs = newGameState()
+        self.pending_commands = []  # commands read while pondering, handled once it stops
+        self.last_best_move_ID = None
+        self.ponder_next = False  # set when the AI's own move was played and the human is to move
+        self.ponder_result = None  # finished ponder search of the current position, waiting for a search command
+        self.search_ID = None  # the search whose progress is reported, None while pondering on a guess
+        ChessAI.interrupt_check = self.hasNewCommand
+        ChessAI.iteration_callback = self.sendInfo
+
+    def run(self):
+        while True:
+            if self.pending_commands:
+                command = self.pending_commands.pop(0)
+            else:
+                command = self.command_queue.get()
+            if command[0] == "quit":
+                self.result_queue.put(("stopped",))
+                break
+            self.handleCommand(command)
+            if PONDER and ChessAI.WORKERS == 1 and self.ponder_next and not self.hasNewCommand():
+                self.ponder_next = False
+                self.ponder()
+
+    # a search stops early when the UI sends a new command, its result would be discarded anyway
+    def hasNewCommand(self):
+        return len(self.pending_commands) > 0 or not self.command_queue.empty()
+
+    def handleCommand(self, command):
+        if command[0] != "search":
+            self.ponder_result = None
+        if command[0] == "move":
+            self.ponder_next = command[1] == self.last_best_move_ID
+            for move in self.gs.getValidMoves():
+                if move.move_ID == command[1]:
+                    self.gs.makeMove(move)
+                    break
+        elif command[0] == "undo":
+            self.ponder_next = False
+            self.gs.undoMoves()
+        elif command[0] == "reset":
+            self.ponder_next = False
+            self.gs = newGameState()
+        elif command[0] == "stats":
+            ChessAI.COLLECT_STATS = command[1]
+        elif command[0] == "search":
+            if self.ponder_result is not None:
+                move = self.ponder_result
+                self.ponder_result = None
+            else:
+                self.search_ID = command[1]
+                move = ChessAI.searchBestMove(self.gs, self.gs.getValidMoves(), command[2])
+                self.search_ID = None
+            self.sendBestMove(command[1], move)
+
+    def sendInfo(self, depth, score, nodes, move):
+        if self.search_ID is not None:
+            self.result_queue.put(("info", self.search_ID, depth, score, move.move_ID if move is not None else None))
+
+    def sendBestMove(self, search_ID, move):
+        self.last_best_move_ID = move.move_ID if move is not None else None
+        self.result_queue.put(("bestmove", search_ID, self.last_best_move_ID, ChessAI.search_stats))
+
+    # Play the reply the last search expected and search the position after it until the human moves.
+    # On a ponder hit the search carries on as the real search, on a miss it stops and only the
+    # transposition table keeps what it learned.
+    def ponder(self):
+        entry = ChessAI.transposition_table.probe(self.gs.zobrist_key)
+        if entry is None:
+            return
+        ponder_move = None
+        for move in self.gs.getValidMoves():
+            if move.move_ID == entry[4]:
+                ponder_move = move
+        if ponder_move is None:
+            return
+
+        self.gs.makeMove(ponder_move)
+        self.ponder_move_ID = ponder_move.move_ID
+        self.ponder_hit = False
+        self.ponder_search_ID = None
+        self.ponder_start = time.perf_counter()
+        ChessAI.interrupt_check = self.checkPonderCommands
+        move = ChessAI.searchBestMove(self.gs, self.gs.getValidMoves(), float("inf"))
+        ChessAI.interrupt_check = self.hasNewCommand
+        self.search_ID = None
+
+        if not self.ponder_hit:
+            self.gs.undoMoves()
+        elif self.ponder_search_ID is not None:
+            self.sendBestMove(self.ponder_search_ID, move)
+        else:
+            # the search finished before the UI asked for it
+            self.ponder_result = move
+
+    # Called from inside the ponder search, returns True to stop it
+    def checkPonderCommands(self):
+        while not self.command_queue.empty():
+            command = self.command_queue.get()
+            if not self.ponder_hit and command[0] == "move" and command[1] == self.ponder_move_ID:
+                self.ponder_hit = True
+            elif self.ponder_hit and self.ponder_search_ID is None and command[0] == "search":
+                self.ponder_search_ID = command[1]
+                self.search_ID = command[1]  # from now on the ponder search reports as this search
+                # the time spent pondering counts towards this move's budget
+                ChessAI.deadline = max(time.perf_counter(), self.ponder_start + command[2])
+            else:
+                self.pending_commands.append(command)
+                return True
+        return False
+
+class EngineWorker():
+
+    # on_message, when given, is called from a watcher thread with every result as soon as it arrives,
+    # instead of the caller polling with pollBestMove
+    def __init__(self, on_message=None):
+        self.command_queue = Queue()
+        self.result_queue = Queue()
+        self.search_ID = 0
+        # not a daemon, daemon processes can't start the pool used by a parallel search
+        self.process = Process(target=engineLoop, args=(self.command_queue, self.result_queue))
+        self.process.start()
+        self.watcher = None
+        if on_message is not None:
+            self.watcher = threading.Thread(target=self.watchResults, args=(on_message,), daemon=True)
+            self.watcher.start()
+
+    def watchResults(self, on_message):
+        while True:
+            message = self.result_queue.get()
+            if message[0] == "stopped":
+                break
+            on_message(message)
+
+    # whether a result belongs to the search running now, results of cancelled searches are ignored
+    def isCurrentSearch(self, search_ID):
+        return search_ID == self.search_ID
+
+    def makeMove(self, move):
+        self.command_queue.put(("move", move.move_ID))
+
+    def undoMove(self):
+        self.command_queue.put(("undo",))
+
+    def reset(self):
+        self.command_queue.put(("reset",))
+
+    # collect search statistics from now on, they come with every bestmove result
+    def collectStats(self, on=True):
+        self.command_queue.put(("stats", on))
+
+    def startSearch(self, time_limit=ChessAI.TIME_LIMIT):
+        self.search_ID += 1
+        self.command_queue.put(("search", self.search_ID, time_limit))
+
+    # results of searches started before this are ignored
+    def cancelSearch(self):
+        self.search_ID += 1
+
+    # Returns (True, move_ID) once the current search is done, move_ID is None if the AI found no move.
+    # Only for a worker without on_message, the watcher thread would be reading the same queue
+    def pollBestMove(self):
+        if self.watcher is not None:
+            raise RuntimeError("pollBestMove can't be used when results go to on_message")
+        while not self.result_queue.empty():
+            message = self.result_queue.get()
+            if message[0] == "bestmove" and message[1] == self.search_ID:
+                return True, message[2]
+        return False, None
+
+    def quit(self):
+        self.command_queue.put(("quit",))
+        self.process.join()
+        if self.watcher is not None:
+            self.watcher.join()
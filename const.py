@@ -1,4 +1,3 @@
-import pygame
 # Screen dimensions
 WIDTH = 512
 HEIGHT = 512
@@ -9,7 +8,11 @@ MOVE_LOG_PANEL_HEIGHT = HEIGHT
 DIMENSIONS = 8
 SQSIZE = WIDTH // DIMENSIONS
 
-MAX_FPS = 15
+# moves slide into place over a fixed time, drawn at up to ANIMATION_FPS
+ANIMATION_SECONDS = 0.25
+ANIMATION_FPS = 60
+# 'p' shows the frame profiler, its timings are written to this CSV file when it is turned off, None keeps no file
+PROFILE_CSV = None
 IMAGES = {}
 
 ALPHACOLS = {0: 'a', 1: 'b', 2: 'c', 3: 'd', 4: 'e', 5: 'f', 6: 'g', 7: 'h'}
@@ -19,6 +22,7 @@ Initilize a global dictionary of images.
 '''
 
 def loadImages():
+    import pygame  # only the UI needs pygame, the engine and AI run without it
     pieces = ["wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK"]
 
     for piece in pieces: